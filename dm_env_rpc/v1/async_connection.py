@@ -46,15 +46,36 @@ exceptions, so explicit error handling code isn't needed per call.
 """
 
 import asyncio
-from typing import Optional, Sequence, Tuple
+import collections
+import threading
+from typing import Any, Deque, List, Optional, Sequence, Set, Tuple
 
 import grpc
 
+from dm_env_rpc.v1 import dm_env_rpc_pb2
 from dm_env_rpc.v1 import dm_env_rpc_pb2_grpc
 from dm_env_rpc.v1 import message_utils
 
 
 Metadata = Sequence[Tuple[str, str]]
+ChannelOptions = Sequence[Tuple[str, Any]]
+
+
+# Event loop used to close channels whose own event loop has already been
+# closed, e.g. when a connection created with `asyncio.run` is garbage
+# collected.  It is reused to avoid creating and tearing down an event loop for
+# every close.
+_shutdown_loop: Optional[asyncio.AbstractEventLoop] = None
+_shutdown_loop_lock = threading.Lock()
+
+
+def _run_until_complete_on_shutdown_loop(coroutine):
+  """Runs `coroutine` to completion on the shared shutdown event loop."""
+  global _shutdown_loop
+  with _shutdown_loop_lock:
+    if _shutdown_loop is None or _shutdown_loop.is_closed():
+      _shutdown_loop = asyncio.new_event_loop()
+    return _shutdown_loop.run_until_complete(coroutine)
 
 
 class AsyncConnection:
@@ -73,6 +94,17 @@ class AsyncConnection:
     self._stream = dm_env_rpc_pb2_grpc.EnvironmentStub(channel).Process(
         metadata=metadata
     )
+    # Futures awaiting a response, paired with the field name expected in the
+    # response.  The stream is FIFO, so responses resolve these in order.
+    self._pending: Deque[Tuple[asyncio.Future, str]] = collections.deque()
+    # Requests waiting to be written, in the order they were sent.  gRPC only
+    # permits one outstanding write per stream, so a single task writes them.
+    self._unwritten: Deque[dm_env_rpc_pb2.EnvironmentRequest] = (
+        collections.deque())
+    self._reader_task: Optional[asyncio.Future] = None
+    self._writer_task: Optional[asyncio.Future] = None
+    # Background work owned by this connection, awaited by `aclose`.
+    self._background_tasks: Set[asyncio.Future] = set()
 
   async def send(
       self,
@@ -83,7 +115,10 @@ class AsyncConnection:
     such as CreateWorldRequest. Based on the type the correct payload for the
     EnvironmentRequest will be constructed and sent to the dm_env_rpc server.
 
-    Returns an awaitable future to retrieve the response.
+    Returns an awaitable future to retrieve the response.  Concurrent calls are
+    pipelined over the stream: each request is written without waiting on the
+    responses of earlier requests, and responses are matched to requests in the
+    order they were sent.
 
     Args:
       request: An instance of a dm_env_rpc Request type, such as
@@ -101,18 +136,168 @@ class AsyncConnection:
       ValueError: The dm_env_rpc server responded to the request with an
         unexpected response message.
     """
+    return await self.send_nowait(request)
+
+  def send_nowait(
+      self, request: message_utils.DmEnvRpcRequest
+  ) -> 'asyncio.Future[message_utils.DmEnvRpcResponse]':
+    """Sends `request` to the dm_env_rpc server without waiting for a response.
+
+    Must be called from a coroutine running on the connection's event loop.
+    Requests are written to the stream in the order they are sent, whether via
+    this method, `send` or `send_many`, so independent requests can be issued
+    without creating a task for each:
+
+        futures = [connection.send_nowait(request) for request in requests]
+        responses = await asyncio.gather(*futures)
+
+    Args:
+      request: An instance of a dm_env_rpc Request type, such as
+        CreateWorldRequest.
+
+    Returns:
+      An asyncio Future resolving to the response from the dm_env_rpc server,
+      unwrapped from the EnvironmentStream message.  The future raises
+      DmEnvRpcError if the server responded with an error, ValueError if it
+      responded with an unexpected response message, or ConnectionError if the
+      server closed the stream before responding.
+
+    Raises:
+      ValueError: The connection is closed.
+    """
     environment_request, field_name = (
         message_utils.pack_environment_request(request))
     if self._stream is None:
       raise ValueError('Cannot send request after stream is closed.')
-    await self._stream.write(environment_request)
-    return message_utils.unpack_environment_response(await self._stream.read(),
-                                                     field_name)
+    return self._enqueue(environment_request, field_name)
+
+  async def send_many(
+      self, requests: Sequence[message_utils.DmEnvRpcRequest]
+  ) -> List[message_utils.DmEnvRpcResponse]:
+    """Sends `requests` to the dm_env_rpc server and returns their responses.
+
+    All requests are written to the stream back-to-back before any responses
+    are read, avoiding a write/read round-trip per request.  Responses are
+    returned in the same order as `requests`.
+
+    Args:
+      requests: A sequence of dm_env_rpc Request types, such as StepRequest.
+
+    Returns:
+      A list of responses from the dm_env_rpc server, one per request, unwrapped
+      from their EnvironmentResponse messages.
+
+    Raises:
+      DmEnvRpcError: The dm_env_rpc server responded to any of the requests with
+        an error.  All responses are read from the stream before raising.
+      ValueError: The dm_env_rpc server responded to a request with an
+        unexpected response message.
+    """
+    packed_requests = [
+        message_utils.pack_environment_request(request) for request in requests
+    ]
+    if self._stream is None:
+      raise ValueError('Cannot send request after stream is closed.')
+    futures = [
+        self._enqueue(environment_request, field_name)
+        for environment_request, field_name in packed_requests
+    ]
+    responses = await asyncio.gather(*futures, return_exceptions=True)
+    for response in responses:
+      if isinstance(response, BaseException):
+        raise response
+    return responses
+
+  def _enqueue(
+      self,
+      environment_request: dm_env_rpc_pb2.EnvironmentRequest,
+      field_name: str,
+  ) -> asyncio.Future:
+    """Queues `environment_request` for writing, returning a response future."""
+    future = asyncio.get_running_loop().create_future()
+    self._pending.append((future, field_name))
+    self._unwritten.append(environment_request)
+    # Start reading alongside writing, so the read and write are both in flight
+    # after a single pass of the event loop.
+    if self._writer_task is None or self._writer_task.done():
+      self._writer_task = self._track(
+          asyncio.ensure_future(self._write_requests(self._stream)))
+    if self._reader_task is None or self._reader_task.done():
+      self._reader_task = self._track(
+          asyncio.ensure_future(self._read_responses(self._stream)))
+    return future
+
+  async def _write_requests(self, stream: grpc.aio.StreamStreamCall):
+    """Writes queued requests to `stream` until none are left."""
+    while self._unwritten:
+      environment_request = self._unwritten.popleft()
+      try:
+        await stream.write(environment_request)
+      except Exception as e:  # pylint: disable=broad-except
+        # The stream is unusable, so no further responses will arrive.
+        self._unwritten.clear()
+        self._fail_pending(e)
+        return
+
+  async def _read_responses(self, stream: grpc.aio.StreamStreamCall):
+    """Reads responses from `stream` until no requests are pending."""
+    while self._pending:
+      try:
+        environment_response = await stream.read()
+      except Exception as e:  # pylint: disable=broad-except
+        self._fail_pending(e)
+        return
+      if environment_response is grpc.aio.EOF:
+        self._fail_pending(ConnectionError(
+            'Stream was closed by the server before all responses were '
+            'received.'))
+        return
+      if not self._pending:
+        # The connection was closed while waiting on the read.
+        return
+      future, field_name = self._pending.popleft()
+      if future.done():
+        # The caller stopped waiting on this response, e.g. was cancelled.
+        continue
+      try:
+        future.set_result(message_utils.unpack_environment_response(
+            environment_response, field_name))
+      except Exception as e:  # pylint: disable=broad-except
+        future.set_exception(e)
+
+  def _track(self, task: asyncio.Future) -> asyncio.Future:
+    """Tracks `task` as background work, until it completes."""
+    self._background_tasks.add(task)
+    task.add_done_callback(self._background_tasks.discard)
+    return task
+
+  def _fail_pending(self, exception: Exception):
+    """Fails all futures still waiting on a response with `exception`."""
+    while self._pending:
+      future, _ = self._pending.popleft()
+      if not future.done():
+        future.set_exception(exception)
 
   def close(self):
     """Closes the connection.  Call when the connection is no longer needed."""
     if self._stream:
       self._stream = None
+      self._unwritten.clear()
+      for task in (self._writer_task, self._reader_task):
+        if task is not None and not task.done():
+          task.cancel()
+      while self._pending:
+        future, _ = self._pending.popleft()
+        future.cancel()
+
+  async def aclose(self):
+    """Closes the connection and waits for its background tasks to finish.
+
+    Unlike `close`, this can only be called from a coroutine, but guarantees the
+    connection has fully shut down, e.g. the channel is closed, on return.
+    """
+    self.close()
+    await asyncio.gather(*self._background_tasks, return_exceptions=True)
 
   def __exit__(self, *args, **kwargs):
     self.close()
@@ -125,6 +310,7 @@ async def create_secure_async_channel_and_connect(
     server_address: str,
     credentials: grpc.ChannelCredentials = grpc.local_channel_credentials(),
     metadata: Optional[Metadata] = None,
+    channel_options: Optional[ChannelOptions] = None,
 ) -> AsyncConnection:
   """Creates a secure async channel from address and credentials and connects.
 
@@ -136,15 +322,20 @@ async def create_secure_async_channel_and_connect(
     credentials: gRPC credentials necessary to connect to the server.
     metadata: Optional sequence of 2-tuples, sent to the gRPC server as
         metadata.
+    channel_options: Optional sequence of (key, value) gRPC channel arguments,
+        e.g. to enable keepalive.  These replace any defaults with the same key.
 
   Returns:
     An instance of dm_env_rpc.AsyncConnection, where the async channel is closed
     upon the connection being closed.
   """
-  options = [('grpc.max_send_message_length', -1),
-             ('grpc.max_receive_message_length', -1)]
+  options = {
+      'grpc.max_send_message_length': -1,
+      'grpc.max_receive_message_length': -1,
+  }
+  options.update(channel_options or ())
   channel = grpc.aio.secure_channel(server_address, credentials,
-                                    options=options)
+                                    options=list(options.items()))
   await channel.channel_ready()
 
   class _ConnectionWrapper(AsyncConnection):
@@ -153,19 +344,33 @@ async def create_secure_async_channel_and_connect(
     def __init__(self, channel, metadata):
       super().__init__(channel=channel, metadata=metadata)
       self._channel = channel
+      # The event loop the channel was created on, and so must be closed on.
+      self._loop = asyncio.get_running_loop()
 
     def __del__(self):
       self.close()
 
     def close(self):
       super().close()
+      channel, self._channel = self._channel, None
+      if channel is None:
+        return None
       try:
-        loop = asyncio.get_running_loop()
+        running_loop = asyncio.get_running_loop()
       except RuntimeError:
-        loop = None
-      if loop and loop.is_running():
-        return asyncio.ensure_future(self._channel.close())
+        running_loop = None
+      if self._loop.is_running():
+        if running_loop is self._loop:
+          return self._track(self._loop.create_task(channel.close()))
+        # Tasks can't be created on a loop from outside its thread.
+        return asyncio.run_coroutine_threadsafe(channel.close(), self._loop)
+      elif running_loop is not None:
+        # The channel's own loop can't be run while another loop is running on
+        # this thread.
+        return running_loop.create_task(channel.close())
+      elif not self._loop.is_closed():
+        return self._loop.run_until_complete(channel.close())
       else:
-        return asyncio.run(self._channel.close())
+        return _run_until_complete_on_shutdown_loop(channel.close())
 
   return _ConnectionWrapper(channel=channel, metadata=metadata)
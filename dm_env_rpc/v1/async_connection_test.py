@@ -16,7 +16,7 @@
 
 import asyncio
 import contextlib
-import queue
+import threading
 import unittest
 from unittest import mock
 
@@ -55,32 +55,53 @@ def _wrap_in_any(proto):
   return any_proto
 
 
-_REQUEST_RESPONSE_PAIRS = {
-    dm_env_rpc_pb2.EnvironmentRequest(
-        create_world=_CREATE_REQUEST).SerializeToString():
-        dm_env_rpc_pb2.EnvironmentResponse(create_world=_CREATE_RESPONSE),
-    dm_env_rpc_pb2.EnvironmentRequest(
-        create_world=_BAD_CREATE_REQUEST).SerializeToString():
-        _TEST_ERROR,
-    dm_env_rpc_pb2.EnvironmentRequest(
-        extension=_wrap_in_any(_EXTENSION_REQUEST)).SerializeToString():
-        dm_env_rpc_pb2.EnvironmentResponse(
-            extension=_wrap_in_any(_EXTENSION_RESPONSE)),
-    dm_env_rpc_pb2.EnvironmentRequest(
-        destroy_world=_INCORRECT_RESPONSE_TEST_MSG).SerializeToString():
-        _INCORRECT_RESPONSE,
-}
+_REQUEST_RESPONSE_PAIRS = (
+    (dm_env_rpc_pb2.EnvironmentRequest(create_world=_CREATE_REQUEST),
+     dm_env_rpc_pb2.EnvironmentResponse(create_world=_CREATE_RESPONSE)),
+    (dm_env_rpc_pb2.EnvironmentRequest(create_world=_BAD_CREATE_REQUEST),
+     _TEST_ERROR),
+    (dm_env_rpc_pb2.EnvironmentRequest(
+        extension=_wrap_in_any(_EXTENSION_REQUEST)),
+     dm_env_rpc_pb2.EnvironmentResponse(
+         extension=_wrap_in_any(_EXTENSION_RESPONSE))),
+    (dm_env_rpc_pb2.EnvironmentRequest(
+        destroy_world=_INCORRECT_RESPONSE_TEST_MSG),
+     _INCORRECT_RESPONSE),
+)
+
+
+def _response_for(request):
+  """Returns the canned response for `request`, or an error if there's none."""
+  for expected_request, response in _REQUEST_RESPONSE_PAIRS:
+    if request == expected_request:
+      return response
+  return _TEST_ERROR
 
 
 def _process(metadata: async_connection.Metadata) -> grpc.aio.StreamStreamCall:
-  requests = queue.Queue()
+  requests = asyncio.Queue()
 
   async def _write(request):
-    requests.put(request)
+    await requests.put(request)
 
   async def _read():
-    request = requests.get()
-    return _REQUEST_RESPONSE_PAIRS.get(request.SerializeToString(), _TEST_ERROR)
+    return _response_for(await requests.get())
+
+  mock_stream = mock.create_autospec(grpc.aio.StreamStreamCall)
+  mock_stream.write = _write
+  mock_stream.read = _read
+  mock_stream.metadata = metadata
+  return mock_stream
+
+
+def _process_closed_by_server(
+    metadata: async_connection.Metadata) -> grpc.aio.StreamStreamCall:
+
+  async def _write(request):
+    del request
+
+  async def _read():
+    return grpc.aio.EOF
 
   mock_stream = mock.create_autospec(grpc.aio.StreamStreamCall)
   mock_stream.write = _write
@@ -90,11 +111,11 @@ def _process(metadata: async_connection.Metadata) -> grpc.aio.StreamStreamCall:
 
 
 @contextlib.contextmanager
-def _create_mock_async_channel():
+def _create_mock_async_channel(process=_process):
   """Mocks out gRPC and returns a channel to be passed to Connection."""
   with mock.patch.object(async_connection, 'dm_env_rpc_pb2_grpc') as mock_grpc:
     mock_stub_class = mock.create_autospec(dm_env_rpc_pb2_grpc.EnvironmentStub)
-    mock_stub_class.Process = _process
+    mock_stub_class.Process = process
     mock_grpc.EnvironmentStub.return_value = mock_stub_class
     yield mock.MagicMock()
 
@@ -107,6 +128,85 @@ class AsyncConnectionAsyncTests(unittest.IsolatedAsyncioTestCase):
         response = await connection.send(_CREATE_REQUEST)
         self.assertEqual(_CREATE_RESPONSE, response)
 
+  async def test_concurrent_sends_are_pipelined(self):
+    with _create_mock_async_channel() as mock_channel:
+      with async_connection.AsyncConnection(mock_channel) as connection:
+        responses = await asyncio.gather(
+            connection.send(_CREATE_REQUEST),
+            connection.send(_wrap_in_any(_EXTENSION_REQUEST)),
+            connection.send(_BAD_CREATE_REQUEST),
+            return_exceptions=True)
+        self.assertEqual(_CREATE_RESPONSE, responses[0])
+        self.assertEqual(_wrap_in_any(_EXTENSION_RESPONSE), responses[1])
+        self.assertIsInstance(responses[2], error.DmEnvRpcError)
+
+  async def test_aclose_cancels_pending_sends(self):
+    with _create_mock_async_channel() as mock_channel:
+      connection = async_connection.AsyncConnection(mock_channel)
+      await connection.send(_CREATE_REQUEST)
+      future = connection.send_nowait(_CREATE_REQUEST)
+      await connection.aclose()
+      self.assertTrue(future.cancelled())
+      with self.assertRaisesRegex(ValueError, 'stream is closed'):
+        await connection.send(_CREATE_REQUEST)
+
+  async def test_stream_closed_by_server_fails_pending_sends(self):
+    with _create_mock_async_channel(_process_closed_by_server) as mock_channel:
+      with async_connection.AsyncConnection(mock_channel) as connection:
+        futures = [
+            connection.send_nowait(_CREATE_REQUEST),
+            connection.send_nowait(_CREATE_REQUEST),
+        ]
+        for future in futures:
+          with self.assertRaisesRegex(ConnectionError, 'closed by the server'):
+            await future
+
+  async def test_send_nowait(self):
+    with _create_mock_async_channel() as mock_channel:
+      with async_connection.AsyncConnection(mock_channel) as connection:
+        future = connection.send_nowait(_CREATE_REQUEST)
+        extension_response = await connection.send(
+            _wrap_in_any(_EXTENSION_REQUEST))
+        self.assertEqual(_wrap_in_any(_EXTENSION_RESPONSE), extension_response)
+        self.assertEqual(_CREATE_RESPONSE, await future)
+
+  async def test_send_nowait_error(self):
+    with _create_mock_async_channel() as mock_channel:
+      with async_connection.AsyncConnection(mock_channel) as connection:
+        future = connection.send_nowait(_BAD_CREATE_REQUEST)
+        with self.assertRaisesRegex(error.DmEnvRpcError, 'test error'):
+          await future
+
+  async def test_send_nowait_error_after_close(self):
+    with _create_mock_async_channel() as mock_channel:
+      with async_connection.AsyncConnection(mock_channel) as connection:
+        connection.close()
+        with self.assertRaisesRegex(ValueError, 'stream is closed'):
+          connection.send_nowait(_CREATE_REQUEST)
+
+  async def test_send_many(self):
+    with _create_mock_async_channel() as mock_channel:
+      with async_connection.AsyncConnection(mock_channel) as connection:
+        responses = await connection.send_many(
+            [_CREATE_REQUEST, _wrap_in_any(_EXTENSION_REQUEST)])
+        self.assertEqual(
+            [_CREATE_RESPONSE, _wrap_in_any(_EXTENSION_RESPONSE)], responses)
+
+  async def test_send_many_error_reads_all_responses(self):
+    with _create_mock_async_channel() as mock_channel:
+      with async_connection.AsyncConnection(mock_channel) as connection:
+        with self.assertRaisesRegex(error.DmEnvRpcError, 'test error'):
+          await connection.send_many([_BAD_CREATE_REQUEST, _CREATE_REQUEST])
+        response = await connection.send(_CREATE_REQUEST)
+        self.assertEqual(_CREATE_RESPONSE, response)
+
+  async def test_send_many_error_after_close(self):
+    with _create_mock_async_channel() as mock_channel:
+      with async_connection.AsyncConnection(mock_channel) as connection:
+        connection.close()
+        with self.assertRaisesRegex(ValueError, 'stream is closed'):
+          await connection.send_many([_CREATE_REQUEST])
+
   async def test_send_error_after_close(self):
     with _create_mock_async_channel() as mock_channel:
       with async_connection.AsyncConnection(mock_channel) as connection:
@@ -160,12 +260,52 @@ class AsyncConnectionAsyncTests(unittest.IsolatedAsyncioTestCase):
         'valid_address') as connection:
       self.assertIsNotNone(connection)
 
-    await asyncio.gather(*asyncio.all_tasks() - {asyncio.current_task()})
+    await connection.aclose()
 
     mock_async_channel.close.assert_called_once()
     mock_async_channel.channel_ready.assert_called_once()
     mock_secure_channel.assert_called_once()
 
+  @mock.patch.object(grpc.aio, 'secure_channel')
+  async def test_create_secure_channel_appends_channel_options(
+      self, mock_secure_channel):
+    mock_async_channel = mock.MagicMock()
+    mock_async_channel.channel_ready = absltest.mock.AsyncMock()
+    mock_async_channel.close = absltest.mock.AsyncMock()
+    mock_secure_channel.return_value = mock_async_channel
+    channel_options = [('grpc.keepalive_time_ms', 30000)]
+
+    with await async_connection.create_secure_async_channel_and_connect(
+        'valid_address', channel_options=channel_options) as connection:
+      pass
+
+    await connection.aclose()
+
+    options = mock_secure_channel.call_args[1]['options']
+    self.assertEqual(channel_options, options[-len(channel_options):])
+
+  @mock.patch.object(grpc.aio, 'secure_channel')
+  async def test_create_secure_channel_channel_options_override_defaults(
+      self, mock_secure_channel):
+    mock_async_channel = mock.MagicMock()
+    mock_async_channel.channel_ready = absltest.mock.AsyncMock()
+    mock_async_channel.close = absltest.mock.AsyncMock()
+    mock_secure_channel.return_value = mock_async_channel
+
+    with await async_connection.create_secure_async_channel_and_connect(
+        'valid_address',
+        channel_options=[('grpc.max_receive_message_length', 1024)],
+    ) as connection:
+      pass
+
+    await connection.aclose()
+
+    options = mock_secure_channel.call_args[1]['options']
+    self.assertEqual(
+        [1024],
+        [value for key, value in options
+         if key == 'grpc.max_receive_message_length'])
+
 
 class AsyncConnectionSyncTests(absltest.TestCase):
 
@@ -194,6 +334,65 @@ class AsyncConnectionSyncTests(absltest.TestCase):
     mock_async_channel.channel_ready.assert_called_once()
     mock_secure_channel.assert_called_once()
 
+  @absltest.mock.patch.object(grpc.aio, 'secure_channel')
+  def test_close_from_another_thread(self, mock_secure_channel):
+    mock_async_channel = absltest.mock.MagicMock()
+    mock_async_channel.channel_ready = absltest.mock.AsyncMock()
+    mock_async_channel.close = absltest.mock.AsyncMock()
+    mock_secure_channel.return_value = mock_async_channel
+
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever)
+    loop_thread.start()
+    try:
+      connection = asyncio.run_coroutine_threadsafe(
+          async_connection.create_secure_async_channel_and_connect(
+              'valid_address'), loop).result()
+      connection.close().result(timeout=10)
+    finally:
+      loop.call_soon_threadsafe(loop.stop)
+      loop_thread.join()
+      loop.close()
+
+    mock_async_channel.close.assert_called_once()
+
+  @absltest.mock.patch.object(grpc.aio, 'secure_channel')
+  def test_close_while_another_event_loop_is_running(self, mock_secure_channel):
+    mock_async_channel = absltest.mock.MagicMock()
+    mock_async_channel.channel_ready = absltest.mock.AsyncMock()
+    mock_async_channel.close = absltest.mock.AsyncMock()
+    mock_secure_channel.return_value = mock_async_channel
+
+    loop = asyncio.new_event_loop()
+    try:
+      connection = loop.run_until_complete(
+          async_connection.create_secure_async_channel_and_connect(
+              'valid_address'))
+
+      async def close():
+        await connection.close()
+
+      asyncio.run(close())
+    finally:
+      loop.close()
+
+    mock_async_channel.close.assert_called_once()
+
+  @absltest.mock.patch.object(grpc.aio, 'secure_channel')
+  def test_close_outside_event_loop_is_idempotent(self, mock_secure_channel):
+    mock_async_channel = absltest.mock.MagicMock()
+    mock_async_channel.channel_ready = absltest.mock.AsyncMock()
+    mock_async_channel.close = absltest.mock.AsyncMock()
+    mock_secure_channel.return_value = mock_async_channel
+
+    connection = asyncio.run(
+        async_connection.create_secure_async_channel_and_connect(
+            'valid_address'))
+    connection.close()
+    connection.close()
+
+    mock_async_channel.close.assert_called_once()
+
 
 if __name__ == '__main__':
   absltest.main()
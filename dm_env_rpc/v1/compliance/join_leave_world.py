@@ -14,6 +14,7 @@
 # ============================================================================
 """A base class for JoinWorld and LeaveWord tests for a server."""
 import abc
+import collections
 
 from absl.testing import absltest
 import numpy as np
@@ -25,14 +26,8 @@ from dm_env_rpc.v1 import tensor_spec_utils
 
 def _find_duplicates(iterable):
   """Returns a list of duplicate entries found in `iterable`."""
-  duplicates = []
-  seen = set()
-  for item in iterable:
-    if item in seen:
-      duplicates.append(item)
-    else:
-      seen.add(item)
-  return duplicates
+  return [item for item, count in collections.Counter(iterable).items()
+          if count > 1]
 
 
 def _check_tensor_spec(tensor_spec):
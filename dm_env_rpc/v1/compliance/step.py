@@ -16,19 +16,28 @@
 
 import abc
 import functools
+import itertools
 import operator
 
 from absl.testing import absltest
 import numpy as np
 
+from dm_env_rpc.v1 import connection as dm_env_rpc_connection
 from dm_env_rpc.v1 import dm_env_rpc_pb2
 from dm_env_rpc.v1 import error
 from dm_env_rpc.v1 import tensor_spec_utils
 from dm_env_rpc.v1 import tensor_utils
 
 
+_MAX_UID = np.iinfo(np.uint64).max
+
+
 def _find_uid_not_in_set(uid_set):
   """Finds an example UID not in `uid_set`."""
+  uid = max(uid_set, default=-1) + 1
+  if uid <= _MAX_UID:
+    return uid
+  # The largest representable UID is taken, so search for a gap instead.
   uids = set(uid_set)
   uid = 0
   while uid in uids:
@@ -36,21 +45,54 @@ def _find_uid_not_in_set(uid_set):
   return uid
 
 
+@functools.lru_cache(maxsize=None)
 def _is_numeric_type(dtype):
   return (dtype != dm_env_rpc_pb2.DataType.PROTO and
           np.issubdtype(tensor_utils.data_type_to_np_type(dtype), np.number))
 
 
-def _assert_less_equal(x, y, err_msg='', verbose=True):
+def _assert_array_compare(comparison, x, y, header, err_msg, verbose):
+  """Asserts `comparison(x, y)` holds element-wise.
+
+  The common passing case is checked with a single vectorized comparison.
+  `np.testing.assert_array_compare`, which builds the diagnostic message, is
+  only used when that check fails.
+
+  Args:
+    comparison: Element-wise comparison operator, e.g. `operator.__le__`.
+    x: Array to compare.
+    y: Array or scalar to compare against.
+    header: Header for the message raised on failure.
+    err_msg: Error message to be printed on failure.
+    verbose: If True, conflicting values are appended to the error message.
+  """
+  x = np.asanyarray(x)
+  y = np.asanyarray(y)
+  if ((x.ndim == 0 or y.ndim == 0 or x.shape == y.shape) and
+      np.all(comparison(x, y))):
+    return
   np.testing.assert_array_compare(
-      operator.__le__, x, y, err_msg=err_msg, verbose=verbose,
-      header='Arrays are not less or equal ordered', equal_inf=False)
+      comparison, x, y, err_msg=err_msg, verbose=verbose, header=header,
+      equal_inf=False)
+
+
+def _assert_less_equal(x, y, err_msg='', verbose=True):
+  _assert_array_compare(
+      operator.__le__, x, y, header='Arrays are not less or equal ordered',
+      err_msg=err_msg, verbose=verbose)
 
 
 def _assert_greater_equal(x, y, err_msg='', verbose=True):
-  np.testing.assert_array_compare(
-      operator.__ge__, x, y, err_msg=err_msg, verbose=verbose,
-      header='Arrays are not greater or equal ordered', equal_inf=False)
+  _assert_array_compare(
+      operator.__ge__, x, y, header='Arrays are not greater or equal ordered',
+      err_msg=err_msg, verbose=verbose)
+
+
+def _concrete_shape(spec):
+  """Returns `spec`'s shape with variable dimensions set to 1."""
+  shape = np.asarray(spec.shape)
+  shape[shape < 0] = 1
+  return shape
 
 
 def _create_test_value(spec, dtype=None):
@@ -59,9 +101,7 @@ def _create_test_value(spec, dtype=None):
     value = tensor_spec_utils.bounds(spec).min
   else:
     value = tensor_utils.data_type_to_np_type(spec.dtype).type()
-  shape = np.asarray(spec.shape)
-  shape[shape < 0] = 1
-  return np.full(shape=shape, fill_value=value, dtype=dtype)
+  return np.full(shape=_concrete_shape(spec), fill_value=value, dtype=dtype)
 
 
 def _create_test_tensor(spec, dtype=None):
@@ -86,11 +126,16 @@ def _below_min(spec):
   np_type = tensor_utils.data_type_to_np_type(spec.dtype)
   min_type_value = tensor_spec_utils.np_range_info(np_type).min
   minimum = tensor_spec_utils.bounds(spec).min
+  test_value = _create_test_value(spec)
 
-  for index in np.ndindex(*spec.shape):
+  indices = np.ndindex(*spec.shape)
+  if np.isscalar(minimum):
+    # Every element shares the same bound, so one element is representative.
+    indices = itertools.islice(indices, 1)
+  for index in indices:
     min_index_value = minimum if np.isscalar(minimum) else minimum[index]
     if min_type_value < min_index_value:
-      value = _create_test_value(spec)
+      value = test_value.copy()
       value[index] = min_type_value
       yield value, index
 
@@ -111,11 +156,16 @@ def _above_max(spec):
   np_type = tensor_utils.data_type_to_np_type(spec.dtype)
   max_type_value = tensor_spec_utils.np_range_info(np_type).max
   maximum = tensor_spec_utils.bounds(spec).max
+  test_value = _create_test_value(spec)
 
-  for index in np.ndindex(*spec.shape):
+  indices = np.ndindex(*spec.shape)
+  if np.isscalar(maximum):
+    # Every element shares the same bound, so one element is representative.
+    indices = itertools.islice(indices, 1)
+  for index in indices:
     max_index_value = maximum if np.isscalar(maximum) else maximum[index]
     if max_type_value > max_index_value:
-      value = _create_test_value(spec)
+      value = test_value.copy()
       value[index] = max_type_value
       yield value, index
 
@@ -136,6 +186,13 @@ def _find_scalar_within_bounds(spec):
     return np_type.type()
 
 
+def _raise_if_error(response):
+  """Raises `response` if it's an error returned in place of a response."""
+  if isinstance(response, Exception):
+    raise response
+  return response
+
+
 def _step_before_test(function):
   """Decorator which calls step before test function is run."""
   @functools.wraps(function)
@@ -171,26 +228,81 @@ class Step(absltest.TestCase, metaclass=abc.ABCMeta):
   def action_uids(self):
     return set(self.specs.actions.keys())
 
+  @functools.cached_property
+  def observation_np_types(self):
+    """A dict mapping observation UIDs to their NumPy types."""
+    return {uid: tensor_utils.data_type_to_np_type(spec.dtype)
+            for uid, spec in self.specs.observations.items()}
+
+  @functools.cached_property
+  def numeric_observation_uids(self):
+    """The UIDs of observations with a numeric dtype."""
+    return frozenset(uid for uid, spec in self.specs.observations.items()
+                     if _is_numeric_type(spec.dtype))
+
+  @functools.cached_property
+  def action_shapes(self):
+    """A dict mapping action UIDs to their shapes, variable dimensions as 1."""
+    return {uid: _concrete_shape(spec)
+            for uid, spec in self.specs.actions.items()}
+
   @property
   def required_actions(self):
     """A dict of required actions for a Step call."""
     return {}
 
-  @property
+  @functools.cached_property
   def numeric_actions(self):
     return {uid: spec for uid, spec in self.specs.actions.items()
             if _is_numeric_type(spec.dtype)}
 
-  @property
+  @functools.cached_property
   def nonnumeric_actions(self):
     return {uid: spec for uid, spec in self.specs.actions.items()
             if not _is_numeric_type(spec.dtype)}
 
   def step(self, actions=None, **kwargs):
     """Sends a StepRequest and returns the StepResponse."""
-    actions = {**self.required_actions, **(actions or {})}
-    return self.connection.send(
-        dm_env_rpc_pb2.StepRequest(actions=actions, **kwargs))
+    return self.connection.send(self._step_request(actions, **kwargs))
+
+  def step_many(self, step_kwargs, return_exceptions=False):
+    """Sends a StepRequest per kwargs dict and returns the StepResponses.
+
+    If the connection is a dm_env_rpc Connection the requests are sent as a
+    single batch, otherwise they are sent one at a time.
+
+    Args:
+      step_kwargs: A sequence of dicts, each holding the keyword arguments for a
+        call to `step`.
+      return_exceptions: If True, errors are returned in place of the responses
+        they were raised for, rather than raised, so each can be checked in
+        its own subTest.
+
+    Returns:
+      A list of StepResponses, in the same order as `step_kwargs`.
+    """
+    requests = [self._step_request(**kwargs) for kwargs in step_kwargs]
+    if isinstance(self.connection, dm_env_rpc_connection.Connection):
+      return self.connection.send_many(
+          requests, return_exceptions=return_exceptions)
+    responses = []
+    for request in requests:
+      try:
+        responses.append(self.connection.send(request))
+      except Exception as e:  # pylint: disable=broad-except
+        if not return_exceptions:
+          raise
+        responses.append(e)
+    return responses
+
+  def _step_request(self, actions=None, **kwargs):
+    """Returns a StepRequest including the required actions."""
+    required_actions = self.required_actions
+    if actions:
+      kwargs['actions'] = {**required_actions, **actions}
+    elif required_actions:
+      kwargs['actions'] = required_actions
+    return dm_env_rpc_pb2.StepRequest(**kwargs)
 
   # pylint: disable=missing-docstring
   ##############################################################################
@@ -215,22 +327,24 @@ class Step(absltest.TestCase, metaclass=abc.ABCMeta):
     for uid, observation in response.observations.items():
       spec = self.specs.observations[uid]
       with self.subTest(uid=uid, name=spec.name):
-        spec_type = tensor_utils.data_type_to_np_type(spec.dtype)
+        spec_type = self.observation_np_types[uid]
         tensor_type = tensor_utils.get_tensor_type(observation)
         self.assertEqual(spec_type, tensor_type)
 
   def test_all_numerical_observations_in_range(self):
-    numeric_uids = (uid for uid, spec in self.specs.observations.items()
-                    if _is_numeric_type(spec.dtype))
-    response = self.step(requested_observations=numeric_uids)
+    response = self.step(requested_observations=self.numeric_observation_uids)
     for uid, observation in response.observations.items():
       spec = self.specs.observations[uid]
+      has_max = spec.max.WhichOneof('payload') is not None
+      has_min = spec.min.WhichOneof('payload') is not None
+      if not (has_max or has_min):
+        continue
       with self.subTest(uid=uid, name=spec.name):
         unpacked = tensor_utils.unpack_tensor(observation)
         bounds = tensor_spec_utils.bounds(spec)
-        if spec.max.WhichOneof('payload') is not None:
+        if has_max:
           _assert_less_equal(unpacked, bounds.max)
-        if spec.min.WhichOneof('payload') is not None:
+        if has_min:
           _assert_greater_equal(unpacked, bounds.min)
 
   def test_duplicated_requested_observations_are_redundant(self):
@@ -238,11 +352,15 @@ class Step(absltest.TestCase, metaclass=abc.ABCMeta):
     self.assertEqual(self.observation_uids, set(response.observations.keys()))
 
   def test_can_request_each_observation_individually(self):
-    for uid in self.observation_uids:
+    uids = list(self.observation_uids)
+    responses = self.step_many(
+        [{'requested_observations': [uid]} for uid in uids],
+        return_exceptions=True)
+    for uid, response in zip(uids, responses):
       spec = self.specs.observations[uid]
       with self.subTest(uid=uid, name=spec.name):
-        response = self.step(requested_observations=[uid])
-        self.assertEqual([uid], list(response.observations.keys()))
+        self.assertEqual(
+            [uid], list(_raise_if_error(response).observations.keys()))
 
   ##############################################################################
   # Actions
@@ -253,10 +371,13 @@ class Step(absltest.TestCase, metaclass=abc.ABCMeta):
 
   @_step_before_test
   def test_can_send_each_action_individually(self):
-    for uid, spec in self.specs.actions.items():
+    actions = list(self.specs.actions.items())
+    responses = self.step_many(
+        [{'actions': {uid: _create_test_tensor(spec)}} for uid, spec in actions],
+        return_exceptions=True)
+    for (uid, spec), response in zip(actions, responses):
       with self.subTest(uid=uid, name=spec.name):
-        tensor = _create_test_tensor(spec)
-        self.step(actions={uid: tensor})
+        _raise_if_error(response)
 
   @_step_before_test
   def test_cannot_send_wrong_numeric_type_action(self):
@@ -274,9 +395,7 @@ class Step(absltest.TestCase, metaclass=abc.ABCMeta):
     tensor = tensor_utils.pack_tensor(0, dtype=np.int32)
     for uid, spec in self.nonnumeric_actions.items():
       with self.subTest(uid=uid, name=spec.name):
-        shape = np.asarray(spec.shape)
-        shape[shape < 0] = 1
-        tensor.shape[:] = shape
+        tensor.shape[:] = self.action_shapes[uid]
         with self.assertRaises(error.DmEnvRpcError):
           self.step(actions={uid: tensor})
 
@@ -290,8 +409,7 @@ class Step(absltest.TestCase, metaclass=abc.ABCMeta):
   def test_cannot_send_action_below_min(self):
     for uid, spec in self.numeric_actions.items():
       with self.subTest(uid=uid, name=spec.name):
-        shape = np.asarray(spec.shape)
-        shape[shape < 0] = 1
+        shape = self.action_shapes[uid]
         for value, index in _below_min(spec):
           with self.subTest(below_min_index=index):
             tensor = tensor_utils.pack_tensor(value, dtype=spec.dtype)
@@ -303,8 +421,7 @@ class Step(absltest.TestCase, metaclass=abc.ABCMeta):
   def test_cannot_send_action_above_max(self):
     for uid, spec in self.numeric_actions.items():
       with self.subTest(uid=uid, name=spec.name):
-        shape = np.asarray(spec.shape)
-        shape[shape < 0] = 1
+        shape = self.action_shapes[uid]
         for value, index in _above_max(spec):
           with self.subTest(above_max_index=index):
             tensor = tensor_utils.pack_tensor(value, dtype=spec.dtype)
@@ -326,12 +443,16 @@ class Step(absltest.TestCase, metaclass=abc.ABCMeta):
   def test_can_send_variable_dimension_tensor_action(self):
     actions_with_shape = {uid: spec for uid, spec in self.specs.actions.items()
                           if spec.shape}
+    step_kwargs = []
     for uid, spec in actions_with_shape.items():
+      tensor = _create_test_tensor(spec)
+      # Set first dimension to be variable.
+      tensor.shape[0] = -1
+      step_kwargs.append({'actions': {uid: tensor}})
+    responses = self.step_many(step_kwargs, return_exceptions=True)
+    for (uid, spec), response in zip(actions_with_shape.items(), responses):
       with self.subTest(uid=uid, name=spec.name):
-        tensor = _create_test_tensor(spec)
-        # Set first dimension to be variable.
-        tensor.shape[0] = -1
-        self.step(actions={uid: tensor})
+        _raise_if_error(response)
 
   @_step_before_test
   def test_cannot_send_tensor_with_too_many_variable_dimensions(self):
@@ -349,15 +470,19 @@ class Step(absltest.TestCase, metaclass=abc.ABCMeta):
 
   @_step_before_test
   def test_can_send_broadcastable_actions(self):
+    broadcast_actions = []
+    step_kwargs = []
     for uid, spec in self.specs.actions.items():
+      scalar = _find_scalar_within_bounds(spec)
+      if scalar is None:
+        # The action has no scalars we could feasibly broadcast.
+        continue
+      tensor = tensor_utils.pack_tensor(scalar, dtype=spec.dtype)
+      tensor.shape[:] = self.action_shapes[uid]
+      broadcast_actions.append((uid, spec))
+      step_kwargs.append({'actions': {uid: tensor}})
+    responses = self.step_many(step_kwargs, return_exceptions=True)
+    for (uid, spec), response in zip(broadcast_actions, responses):
       with self.subTest(uid=uid, name=spec.name):
-        scalar = _find_scalar_within_bounds(spec)
-        if scalar is None:
-          # The action has no scalars we could feasibly broadcast.
-          continue
-        tensor = tensor_utils.pack_tensor(scalar, dtype=spec.dtype)
-        shape = np.asarray(spec.shape)
-        shape[shape < 0] = 1
-        tensor.shape[:] = shape
-        self.step(actions={uid: tensor})
+        _raise_if_error(response)
   # pylint: enable=missing-docstring
@@ -43,8 +43,14 @@ Any errors encountered in the EnvironmentResponse are turned into Python
 exceptions, so explicit error handling code isn't needed per call.
 """
 
+import collections
+from concurrent import futures
+import functools
 import queue
-from typing import Optional, Protocol, Sequence, Tuple
+import threading
+from typing import (Any, Deque, List, Optional, Protocol, Sequence, Tuple,
+                    Union)
+import weakref
 import grpc
 
 from dm_env_rpc.v1 import dm_env_rpc_pb2
@@ -52,6 +58,7 @@ from dm_env_rpc.v1 import dm_env_rpc_pb2_grpc
 from dm_env_rpc.v1 import message_utils
 
 Metadata = Sequence[Tuple[str, str]]
+ChannelOptions = Sequence[Tuple[str, Any]]
 
 
 class ConnectionType(Protocol):
@@ -72,7 +79,7 @@ class StreamReaderWriter(object):
   def __init__(self,
                stub: dm_env_rpc_pb2_grpc.EnvironmentStub,
                metadata: Optional[Metadata] = None):
-    self._requests = queue.Queue()
+    self._requests = queue.SimpleQueue()
     self._stream = stub.Process(
         iter(self._requests.get, None), metadata=metadata)
 
@@ -84,6 +91,26 @@ class StreamReaderWriter(object):
     """Returns the response from stream.  Blocking."""
     return next(self._stream)
 
+  def close(self, cancel: bool = False):
+    """Ends the request stream.
+
+    Args:
+      cancel: Whether to also cancel the call, e.g. to unblock a thread waiting
+        in `read`.  Otherwise the server sees the end of the request stream.
+    """
+    self._requests.put(None)
+    if cancel:
+      cancel_call = getattr(self._stream, 'cancel', None)
+      if cancel_call is not None:
+        cancel_call()
+
+
+# Placeholder in `Connection._pending` while the caller of `send` or
+# `send_many` reads its own responses, so the reader thread must not read.
+_READ_BY_CALLER = (None, '')
+
+_PendingResponse = Optional[Tuple[Optional[futures.Future], str]]
+
 
 class Connection(object):
   """A helper class for interacting with dm_env_rpc servers."""
@@ -100,6 +127,12 @@ class Connection(object):
     """
     self._stream = StreamReaderWriter(
         dm_env_rpc_pb2_grpc.EnvironmentStub(channel), metadata)
+    # Responses still to be read, in the order their requests were sent.
+    # Futures from `send_async` are resolved by `_reader`.  `_pending` is
+    # guarded by `_pending_condition`, and a None entry tells `_reader` to stop.
+    self._pending: Deque[_PendingResponse] = collections.deque()
+    self._pending_condition = threading.Condition()
+    self._reader: Optional[threading.Thread] = None
 
   def send(
       self,
@@ -130,16 +163,179 @@ class Connection(object):
     """
     environment_request, field_name = (
         message_utils.pack_environment_request(request))
-    if self._stream is None:
-      raise ValueError('Cannot send request after stream is closed.')
-    self._stream.write(environment_request)
-    return message_utils.unpack_environment_response(self._stream.read(),
+    with self._pending_condition:
+      stream = self._stream
+      if stream is None:
+        raise ValueError('Cannot send request after stream is closed.')
+      if self._pending:
+        future = self._enqueue(environment_request, field_name)
+      else:
+        future = None
+        self._pending.append(_READ_BY_CALLER)
+        stream.write(environment_request)
+    if future is not None:
+      return future.result()
+    try:
+      environment_response = stream.read()
+    finally:
+      self._finish_reading()
+    return message_utils.unpack_environment_response(environment_response,
                                                      field_name)
 
+  def send_async(
+      self, request: message_utils.DmEnvRpcRequest
+  ) -> 'futures.Future[message_utils.DmEnvRpcResponse]':
+    """Sends `request` to the dm_env_rpc server without waiting for a response.
+
+    Several requests can be outstanding at once.  The server processes them in
+    the order they were sent, so later requests may depend on earlier ones.
+
+    The first call starts a background thread to read responses, which stops
+    when the connection is closed or garbage collected.  While any futures are
+    pending, `send` and `send_many` also wait on their responses through this
+    thread.
+
+    Args:
+      request: An instance of a dm_env_rpc Request type, such as
+        CreateWorldRequest.
+
+    Returns:
+      A future for the response the dm_env_rpc server returns, unwrapped from
+      its EnvironmentResponse message.  If the server responds with an error,
+      the future raises DmEnvRpcError, or ConnectionError if the server closes
+      the stream before responding.  If the connection is closed before the
+      response is read, the future is cancelled.
+    """
+    environment_request, field_name = (
+        message_utils.pack_environment_request(request))
+    with self._pending_condition:
+      if self._stream is None:
+        raise ValueError('Cannot send request after stream is closed.')
+      return self._enqueue(environment_request, field_name)
+
+  def _enqueue(
+      self,
+      environment_request: dm_env_rpc_pb2.EnvironmentRequest,
+      field_name: str,
+  ) -> futures.Future:
+    """Writes `environment_request`, returning a future for its response.
+
+    Must be called with `_pending_condition` held.
+
+    Args:
+      environment_request: The EnvironmentRequest to write to the stream.
+      field_name: The name of the field expected in the response.
+
+    Returns:
+      A future resolved by the reader thread.
+    """
+    future = futures.Future()
+    self._pending.append((future, field_name))
+    self._stream.write(environment_request)
+    if self._reader is None:
+      # The thread is only given what it reads from and resolves, so it
+      # doesn't keep the connection alive, and is stopped once the connection
+      # is garbage collected.
+      self._reader = threading.Thread(
+          target=_read_responses,
+          args=(self._stream, self._pending, self._pending_condition),
+          daemon=True)
+      self._reader.start()
+      weakref.finalize(
+          self, _stop_reading, self._pending, self._pending_condition)
+    self._pending_condition.notify()
+    return future
+
+  def _finish_reading(self):
+    """Lets the reader thread read again, once `send` has read its responses."""
+    with self._pending_condition:
+      if self._pending and self._pending[0] is _READ_BY_CALLER:
+        self._pending.popleft()
+        self._pending_condition.notify()
+
+  def send_many(
+      self,
+      requests: Sequence[message_utils.DmEnvRpcRequest],
+      return_exceptions: bool = False,
+  ) -> List[Union[message_utils.DmEnvRpcResponse, Exception]]:
+    """Sends `requests` to the dm_env_rpc server and returns their responses.
+
+    All requests are written to the stream back-to-back before any responses
+    are read, so the batch costs a single round-trip rather than one per
+    request.  Responses are returned in the same order as `requests`.
+
+    Blocks until the server sends back all responses.
+
+    Args:
+      requests: A sequence of dm_env_rpc Request types, such as StepRequest.
+      return_exceptions: If True, errors are returned in place of the responses
+        they were raised for, rather than raised.
+
+    Returns:
+      A list of responses from the dm_env_rpc server, one per request, unwrapped
+      from their EnvironmentResponse messages.
+
+    Raises:
+      DmEnvRpcError: The dm_env_rpc server responded to any of the requests with
+        an error.  All responses are read from the stream before raising.
+      ValueError: The dm_env_rpc server responded to a request with an
+        unexpected response message.
+    """
+    packed_requests = [
+        message_utils.pack_environment_request(request) for request in requests
+    ]
+    with self._pending_condition:
+      stream = self._stream
+      if stream is None:
+        raise ValueError('Cannot send request after stream is closed.')
+      if self._pending:
+        response_futures = [
+            self._enqueue(environment_request, field_name)
+            for environment_request, field_name in packed_requests
+        ]
+      else:
+        response_futures = None
+        self._pending.append(_READ_BY_CALLER)
+        for environment_request, _ in packed_requests:
+          stream.write(environment_request)
+    if response_futures is not None:
+      futures.wait(response_futures)
+      get_responses = [future.result for future in response_futures]
+    else:
+      try:
+        environment_responses = [stream.read() for _ in packed_requests]
+      finally:
+        self._finish_reading()
+      get_responses = [
+          functools.partial(message_utils.unpack_environment_response,
+                            environment_response, field_name)
+          for environment_response, (_, field_name) in zip(
+              environment_responses, packed_requests)
+      ]
+    responses = []
+    for get_response in get_responses:
+      try:
+        responses.append(get_response())
+      except Exception as e:  # pylint: disable=broad-except
+        if not return_exceptions:
+          raise
+        responses.append(e)
+    return responses
+
   def close(self):
     """Closes the connection.  Call when the connection is no longer needed."""
-    if self._stream:
-      self._stream = None
+    with self._pending_condition:
+      stream, self._stream = self._stream, None
+      pending = [item for item in self._pending if item is not None]
+      self._pending.clear()
+      self._pending.append(None)
+      self._pending_condition.notify_all()
+    for future, _ in pending:
+      if future is not None:
+        future.cancel()
+    if stream is not None:
+      # Only cancel the call if a thread may be blocked reading it.
+      stream.close(cancel=bool(pending))
 
   def __exit__(self, *args, **kwargs):
     self.close()
@@ -148,11 +344,64 @@ class Connection(object):
     return self
 
 
+def _stop_reading(
+    pending: Deque[_PendingResponse], pending_condition: threading.Condition):
+  """Stops the reader thread once it has resolved the futures in `pending`."""
+  with pending_condition:
+    pending.append(None)
+    pending_condition.notify()
+
+
+def _read_responses(
+    stream: StreamReaderWriter,
+    pending: Deque[_PendingResponse],
+    pending_condition: threading.Condition):
+  """Resolves `pending` futures in order with responses read from `stream`."""
+  while True:
+    with pending_condition:
+      while not pending or pending[0] is _READ_BY_CALLER:
+        pending_condition.wait()
+      if pending[0] is None:
+        return
+    try:
+      environment_response = stream.read()
+    except StopIteration:
+      read_error = ConnectionError(
+          'Stream was closed by the server before all responses were '
+          'received.')
+    except Exception as e:  # pylint: disable=broad-except
+      read_error = e
+    else:
+      read_error = None
+    if read_error is not None:
+      # The stream is unusable, so fail everything sent so far.
+      with pending_condition:
+        failed = []
+        while pending and pending[0] is not None:
+          failed.append(pending.popleft())
+      for future, _ in failed:
+        if future.set_running_or_notify_cancel():
+          future.set_exception(read_error)
+      continue
+    with pending_condition:
+      if not pending or pending[0] is None:
+        continue
+      future, field_name = pending.popleft()
+    if not future.set_running_or_notify_cancel():
+      continue
+    try:
+      future.set_result(message_utils.unpack_environment_response(
+          environment_response, field_name))
+    except Exception as e:  # pylint: disable=broad-except
+      future.set_exception(e)
+
+
 def create_secure_channel_and_connect(
     server_address: str,
     credentials: grpc.ChannelCredentials = grpc.local_channel_credentials(),
     timeout: Optional[float] = None,
     metadata: Optional[Metadata] = None,
+    channel_options: Optional[ChannelOptions] = None,
 ) -> Connection:
   """Creates a secure channel from server address and credentials and connects.
 
@@ -166,14 +415,22 @@ def create_secure_channel_and_connect(
       Default to waiting indefinitely.
     metadata: Optional sequence of 2-tuples, sent to the gRPC server as
         metadata.
+    channel_options: Optional sequence of (key, value) gRPC channel arguments,
+        e.g. to enable keepalive.  These replace any defaults with the same key.
 
   Returns:
     An instance of dm_env_rpc.Connection, where the channel is close upon the
     connection being closed.
   """
-  options = [('grpc.max_send_message_length', -1),
-             ('grpc.max_receive_message_length', -1)]
-  channel = grpc.secure_channel(server_address, credentials, options=options)
+  options = {
+      'grpc.max_send_message_length': -1,
+      'grpc.max_receive_message_length': -1,
+  }
+  # gRPC uses the first occurrence of a repeated argument, so merge rather than
+  # append to let callers override the defaults.
+  options.update(channel_options or ())
+  channel = grpc.secure_channel(server_address, credentials,
+                                options=list(options.items()))
   grpc.channel_ready_future(channel).result(timeout)
 
   class _ConnectionWrapper(Connection):
@@ -14,8 +14,12 @@
 # ============================================================================
 """Tests for Connection."""
 
+from concurrent import futures
 import contextlib
+import gc
+import threading
 from unittest import mock
+import weakref
 
 from absl.testing import absltest
 import grpc
@@ -51,36 +55,59 @@ def _wrap_in_any(proto):
   return any_proto
 
 
-_REQUEST_RESPONSE_PAIRS = {
-    dm_env_rpc_pb2.EnvironmentRequest(
-        create_world=_CREATE_REQUEST).SerializeToString():
-        dm_env_rpc_pb2.EnvironmentResponse(create_world=_CREATE_RESPONSE),
-    dm_env_rpc_pb2.EnvironmentRequest(
-        create_world=_BAD_CREATE_REQUEST).SerializeToString():
-        _TEST_ERROR,
-    dm_env_rpc_pb2.EnvironmentRequest(
-        extension=_wrap_in_any(_EXTENSION_REQUEST)).SerializeToString():
-        dm_env_rpc_pb2.EnvironmentResponse(
-            extension=_wrap_in_any(_EXTENSION_RESPONSE)),
-    dm_env_rpc_pb2.EnvironmentRequest(
-        destroy_world=_INCORRECT_RESPONSE_TEST_MSG).SerializeToString():
-        _INCORRECT_RESPONSE,
-}
+_REQUEST_RESPONSE_PAIRS = (
+    (dm_env_rpc_pb2.EnvironmentRequest(create_world=_CREATE_REQUEST),
+     dm_env_rpc_pb2.EnvironmentResponse(create_world=_CREATE_RESPONSE)),
+    (dm_env_rpc_pb2.EnvironmentRequest(create_world=_BAD_CREATE_REQUEST),
+     _TEST_ERROR),
+    (dm_env_rpc_pb2.EnvironmentRequest(
+        extension=_wrap_in_any(_EXTENSION_REQUEST)),
+     dm_env_rpc_pb2.EnvironmentResponse(
+         extension=_wrap_in_any(_EXTENSION_RESPONSE))),
+    (dm_env_rpc_pb2.EnvironmentRequest(
+        destroy_world=_INCORRECT_RESPONSE_TEST_MSG),
+     _INCORRECT_RESPONSE),
+)
+
+
+def _response_for(request):
+  """Returns the canned response for `request`, or an error if there's none."""
+  for expected_request, response in _REQUEST_RESPONSE_PAIRS:
+    if request == expected_request:
+      return response
+  return _TEST_ERROR
 
 
 def _process(request_iterator, **kwargs):
   del kwargs
   for request in request_iterator:
-    yield _REQUEST_RESPONSE_PAIRS.get(request.SerializeToString(), _TEST_ERROR)
+    yield _response_for(request)
+
+
+class _BlockingProcessCall:
+  """A fake Process call whose reads block until it's cancelled."""
+
+  def __init__(self):
+    self.cancelled = threading.Event()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    self.cancelled.wait()
+    raise grpc.RpcError('Call cancelled.')
+
+  def cancel(self):
+    self.cancelled.set()
 
 
 @contextlib.contextmanager
-def _create_mock_channel():
+def _create_mock_channel(process=_process):
   """Mocks out gRPC and returns a channel to be passed to Connection."""
   with mock.patch.object(dm_env_rpc_connection,
                          'dm_env_rpc_pb2_grpc') as mock_grpc:
     mock_stub_class = mock.MagicMock()
-    mock_stub_class.Process = _process
+    mock_stub_class.Process = process
     mock_grpc.EnvironmentStub.return_value = mock_stub_class
     yield mock.MagicMock()
 
@@ -93,6 +120,159 @@ class ConnectionTests(absltest.TestCase):
         response = connection.send(_CREATE_REQUEST)
         self.assertEqual(_CREATE_RESPONSE, response)
 
+  def test_send_many(self):
+    with _create_mock_channel() as mock_channel:
+      with dm_env_rpc_connection.Connection(mock_channel) as connection:
+        responses = connection.send_many(
+            [_CREATE_REQUEST, _wrap_in_any(_EXTENSION_REQUEST)])
+        self.assertEqual(
+            [_CREATE_RESPONSE, _wrap_in_any(_EXTENSION_RESPONSE)], responses)
+
+  def test_send_many_error_reads_all_responses(self):
+    with _create_mock_channel() as mock_channel:
+      with dm_env_rpc_connection.Connection(mock_channel) as connection:
+        with self.assertRaisesRegex(error.DmEnvRpcError, 'test error'):
+          connection.send_many([_BAD_CREATE_REQUEST, _CREATE_REQUEST])
+        self.assertEqual(_CREATE_RESPONSE, connection.send(_CREATE_REQUEST))
+
+  def test_send_many_return_exceptions(self):
+    with _create_mock_channel() as mock_channel:
+      with dm_env_rpc_connection.Connection(mock_channel) as connection:
+        responses = connection.send_many(
+            [_CREATE_REQUEST, _BAD_CREATE_REQUEST, _CREATE_REQUEST],
+            return_exceptions=True)
+        self.assertEqual(_CREATE_RESPONSE, responses[0])
+        self.assertIsInstance(responses[1], error.DmEnvRpcError)
+        self.assertEqual(_CREATE_RESPONSE, responses[2])
+
+  def test_send_async(self):
+    with _create_mock_channel() as mock_channel:
+      with dm_env_rpc_connection.Connection(mock_channel) as connection:
+        create_future = connection.send_async(_CREATE_REQUEST)
+        extension_future = connection.send_async(
+            _wrap_in_any(_EXTENSION_REQUEST))
+        self.assertEqual(_CREATE_RESPONSE, create_future.result())
+        self.assertEqual(
+            _wrap_in_any(_EXTENSION_RESPONSE), extension_future.result())
+
+  def test_send_async_error(self):
+    with _create_mock_channel() as mock_channel:
+      with dm_env_rpc_connection.Connection(mock_channel) as connection:
+        future = connection.send_async(_BAD_CREATE_REQUEST)
+        with self.assertRaisesRegex(error.DmEnvRpcError, 'test error'):
+          future.result()
+
+  def test_send_and_send_many_after_send_async(self):
+    with _create_mock_channel() as mock_channel:
+      with dm_env_rpc_connection.Connection(mock_channel) as connection:
+        future = connection.send_async(_CREATE_REQUEST)
+        self.assertEqual(_CREATE_RESPONSE, connection.send(_CREATE_REQUEST))
+        with self.assertRaisesRegex(error.DmEnvRpcError, 'test error'):
+          connection.send_many([_BAD_CREATE_REQUEST, _CREATE_REQUEST])
+        self.assertEqual(_CREATE_RESPONSE, connection.send(_CREATE_REQUEST))
+        self.assertEqual(_CREATE_RESPONSE, future.result())
+
+  def test_send_async_error_after_close(self):
+    with _create_mock_channel() as mock_channel:
+      with dm_env_rpc_connection.Connection(mock_channel) as connection:
+        connection.send_async(_CREATE_REQUEST).result()
+        connection.close()
+        with self.assertRaisesRegex(ValueError, 'stream is closed'):
+          connection.send_async(_CREATE_REQUEST)
+        with self.assertRaisesRegex(ValueError, 'stream is closed'):
+          connection.send(_CREATE_REQUEST)
+
+  def test_close_ends_stream(self):
+    with _create_mock_channel() as mock_channel:
+      connection = dm_env_rpc_connection.Connection(mock_channel)
+      threads = set(threading.enumerate())
+      connection.send_async(_CREATE_REQUEST).result()
+      readers = set(threading.enumerate()) - threads
+      self.assertLen(readers, 1)
+      connection.close()
+      with self.assertRaisesRegex(ValueError, 'stream is closed'):
+        connection.send(_CREATE_REQUEST)
+      reader = readers.pop()
+      reader.join(timeout=10)
+      self.assertFalse(reader.is_alive())
+
+  def test_close_ends_request_stream(self):
+    request_iterators = []
+
+    def process(request_iterator, **kwargs):
+      request_iterators.append(request_iterator)
+      return _process(request_iterator, **kwargs)
+
+    with _create_mock_channel(process) as mock_channel:
+      connection = dm_env_rpc_connection.Connection(mock_channel)
+      connection.close()
+      self.assertEqual([], list(request_iterators[0]))
+
+  def test_close_does_not_cancel_idle_stream(self):
+    call = mock.MagicMock()
+    with _create_mock_channel(lambda *args, **kwargs: call) as mock_channel:
+      connection = dm_env_rpc_connection.Connection(mock_channel)
+      connection.close()
+      call.cancel.assert_not_called()
+
+  def test_close_cancels_blocked_read(self):
+    call = _BlockingProcessCall()
+    with _create_mock_channel(lambda *args, **kwargs: call) as mock_channel:
+      connection = dm_env_rpc_connection.Connection(mock_channel)
+      future = connection.send_async(_CREATE_REQUEST)
+      connection.close()
+      self.assertTrue(future.cancelled())
+      self.assertTrue(call.cancelled.is_set())
+
+  def test_connection_and_reader_are_freed_after_send_async(self):
+    with _create_mock_channel() as mock_channel:
+      connection = dm_env_rpc_connection.Connection(mock_channel)
+      threads = set(threading.enumerate())
+      connection.send_async(_CREATE_REQUEST).result()
+      readers = set(threading.enumerate()) - threads
+      connection_ref = weakref.ref(connection)
+      del connection
+      gc.collect()
+      self.assertIsNone(connection_ref())
+      for reader in readers:
+        reader.join(timeout=10)
+        self.assertFalse(reader.is_alive())
+
+  def test_send_async_stream_closed_by_server(self):
+
+    def process(request_iterator, **kwargs):
+      del request_iterator, kwargs
+      return iter(())
+
+    with _create_mock_channel(process) as mock_channel:
+      with dm_env_rpc_connection.Connection(mock_channel) as connection:
+        future = connection.send_async(_CREATE_REQUEST)
+        with self.assertRaisesRegex(ConnectionError, 'closed by the server'):
+          future.result()
+
+  def test_send_async_during_send_waits_for_its_response(self):
+    request_received = threading.Event()
+    release_responses = threading.Event()
+
+    def process(request_iterator, **kwargs):
+      del kwargs
+      for request in request_iterator:
+        request_received.set()
+        release_responses.wait()
+        yield _response_for(request)
+
+    with _create_mock_channel(process) as mock_channel:
+      with dm_env_rpc_connection.Connection(mock_channel) as connection:
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+          send_future = executor.submit(connection.send, _CREATE_REQUEST)
+          request_received.wait()
+          async_future = connection.send_async(
+              _wrap_in_any(_EXTENSION_REQUEST))
+          release_responses.set()
+          self.assertEqual(_CREATE_RESPONSE, send_future.result())
+          self.assertEqual(
+              _wrap_in_any(_EXTENSION_RESPONSE), async_future.result())
+
   def test_send_error_after_close(self):
     with _create_mock_channel() as mock_channel:
       with dm_env_rpc_connection.Connection(mock_channel) as connection:
@@ -165,6 +345,23 @@ class ConnectionTests(absltest.TestCase):
     mock_channel.close.assert_called_once()
     mock_stream_writer.assert_called_once_with(mock.ANY, metadata)
 
+  @mock.patch.object(grpc, 'secure_channel')
+  @mock.patch.object(grpc, 'channel_ready_future')
+  def test_create_secure_channel_and_connect_channel_options(
+      self, mock_channel_ready, mock_secure_channel):
+    mock_secure_channel.return_value = mock.MagicMock()
+    with dm_env_rpc_connection.create_secure_channel_and_connect(
+        'valid_address',
+        channel_options=[('grpc.keepalive_time_ms', 30000),
+                         ('grpc.max_receive_message_length', 1024)]):
+      pass
+
+    options = dict(mock_secure_channel.call_args[1]['options'])
+    self.assertEqual(30000, options['grpc.keepalive_time_ms'])
+    self.assertEqual(1024, options['grpc.max_receive_message_length'])
+    self.assertEqual(-1, options['grpc.max_send_message_length'])
+    self.assertLen(mock_secure_channel.call_args[1]['options'], len(options))
+
   def test_create_secure_channel_and_connect_timeout(self):
     with self.assertRaises(grpc.FutureTimeoutError):
       dm_env_rpc_connection.create_secure_channel_and_connect(
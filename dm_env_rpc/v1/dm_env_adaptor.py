@@ -14,8 +14,11 @@
 # ============================================================================
 """An implementation of a dm_env environment using dm_env_rpc."""
 
+import collections
+import collections.abc
+from concurrent import futures
 import enum
-from typing import Any, Mapping, NamedTuple, Optional, Sequence, Union
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Sequence, Union
 
 import dm_env
 import immutabledict
@@ -38,6 +41,21 @@ DEFAULT_DISCOUNT_KEY = 'discount'
 # Default key separator, used in flattening/unflattening nested structures.
 DEFAULT_KEY_SEPARATOR = '.'
 
+# EnvironmentStateType values used on every step.  Looking these up through the
+# protobuf enum wrapper is comparatively slow, so they are resolved once here.
+_RUNNING = dm_env_rpc_pb2.EnvironmentStateType.RUNNING
+_INTERRUPTED = dm_env_rpc_pb2.EnvironmentStateType.INTERRUPTED
+_TERMINATED = dm_env_rpc_pb2.EnvironmentStateType.TERMINATED
+
+# StepType for each transition, keyed by whether the environment was RUNNING
+# before and after a step.  Transitions between two non-RUNNING states are
+# errors and have no entry.
+_STEP_TYPES = immutabledict.immutabledict({
+    (False, True): dm_env.StepType.FIRST,
+    (True, True): dm_env.StepType.MID,
+    (True, False): dm_env.StepType.LAST,
+})
+
 # Format string for error message used in DmEnvAdaptor.Reset
 _RESET_ENVIRONMENT_ERROR = r'''Environment changed spec after reset.
 before: "{specs}"
@@ -53,6 +71,48 @@ def _check_response_type(response, expected_type):
     return response
 
 
+def _needs_flattening(actions: Mapping[str, Any]) -> bool:
+  """Returns whether `flatten_dict` could change or reject `actions`."""
+  return any(
+      isinstance(value, collections.abc.Mapping) or DEFAULT_KEY_SEPARATOR in key
+      for key, value in actions.items())
+
+
+def _copy_nested_dict(value: Any) -> Any:
+  """Copies the dicts in nested `value`, so callers can't modify the original."""
+  if isinstance(value, dict):
+    return {key: _copy_nested_dict(item) for key, item in value.items()}
+  return value
+
+
+class _AsyncTimeStep(futures.Future):
+  """A future TimeStep from `DmEnvAdaptor.step_async`.
+
+  The TimeStep is only built when the future is inspected, so the environment's
+  state is updated on the caller's thread rather than the connection's.
+  """
+
+  def __init__(self, process_until):
+    super().__init__()
+    self._process_until = process_until
+
+  def cancelled(self):
+    self._process_until(self, block=False)
+    return super().cancelled()
+
+  def done(self):
+    self._process_until(self, block=False)
+    return super().done()
+
+  def result(self, timeout=None):
+    self._process_until(self, timeout=timeout)
+    return super().result(timeout)
+
+  def exception(self, timeout=None):
+    self._process_until(self, timeout=timeout)
+    return super().exception(timeout)
+
+
 class AutoObservations(enum.Flag):
   """Options for requesting all available observations."""
 
@@ -87,6 +147,7 @@ class DmEnvAdaptor(dm_env.Environment):
       ] = AutoObservations.REQUEST_REGULAR_OBSERVATIONS,
       nested_tensors: bool = True,
       extensions: Mapping[str, Any] = immutabledict.immutabledict(),
+      pipeline_reset: bool = False,
   ):
     """Initializes the environment with the provided dm_env_rpc connection.
 
@@ -100,13 +161,27 @@ class DmEnvAdaptor(dm_env.Environment):
       nested_tensors: Boolean to determine whether to flatten/unflatten tensors.
       extensions: Mapping of extension instances to DmEnvAdaptor attributes.
         Raises ValueError if attribute already exists.
+      pipeline_reset: Whether `reset` sends its first StepRequest along with
+        the ResetRequest, if the connection supports `send_many`.  This saves
+        a round-trip, but the server takes the step even if the reset fails or
+        changes the specs, and `step` is not called, so subclasses overriding
+        it are bypassed.
     """
     self._dm_env_rpc_specs = specs
+    self._serialized_specs = specs.SerializeToString(deterministic=True)
     self._action_specs = spec_manager.SpecManager(specs.actions)
     self._observation_specs = spec_manager.SpecManager(specs.observations)
     self._connection = connection
-    self._last_state = dm_env_rpc_pb2.EnvironmentStateType.TERMINATED
+    self._last_state = _TERMINATED
+    # (TimeStep future, response future) for each unprocessed `step_async`.
+    self._async_steps = collections.deque()
     self._nested_tensors = nested_tensors
+    self._pipeline_reset = pipeline_reset
+    # The dm_env specs never change, so are built on first use and copies of
+    # them returned.
+    self._observation_spec = None
+    self._action_spec = None
+    observation_names = self._observation_specs.names()
 
     if requested_observations is None:
       # For backwards-compatibility
@@ -119,7 +194,7 @@ class DmEnvAdaptor(dm_env.Environment):
       self._is_discount_requested = (
           AutoObservations.REQUEST_DISCOUNT in requested_observations
       )
-      requested_observations = self._observation_specs.names()
+      requested_observations = observation_names
     else:
       self._is_reward_requested = DEFAULT_REWARD_KEY in requested_observations
       self._is_discount_requested = (
@@ -130,35 +205,53 @@ class DmEnvAdaptor(dm_env.Environment):
 
     self._default_reward_spec = None
     self._default_discount_spec = None
-    if DEFAULT_REWARD_KEY in self._observation_specs.names():
+    if DEFAULT_REWARD_KEY in observation_names:
       self._default_reward_spec = dm_env_utils.tensor_spec_to_dm_env_spec(
           self._observation_specs.name_to_spec(DEFAULT_REWARD_KEY)
       )
       requested_observations.add(DEFAULT_REWARD_KEY)
-    if DEFAULT_DISCOUNT_KEY in self._observation_specs.names():
+    if DEFAULT_DISCOUNT_KEY in observation_names:
       self._default_discount_spec = dm_env_utils.tensor_spec_to_dm_env_spec(
           self._observation_specs.name_to_spec(DEFAULT_DISCOUNT_KEY)
       )
       requested_observations.add(DEFAULT_DISCOUNT_KEY)
 
+    # Reward and discount are always requested so they can be processed, but
+    # are only returned as observations if the caller asked for them.
+    self._stripped_observation_names = tuple(
+        name for name, is_requested in (
+            (DEFAULT_REWARD_KEY, self._is_reward_requested),
+            (DEFAULT_DISCOUNT_KEY, self._is_discount_requested),
+        ) if not is_requested and name in requested_observations)
+
     unsupported_observations = requested_observations.difference(
-        self._observation_specs.names()
-    )
+        observation_names)
     if unsupported_observations:
       raise ValueError(
           'Unsupported observations requested: {}'.format(
               unsupported_observations
           )
       )
-    self._requested_observation_uids = [
+    # Sorting is not strictly necessary but it makes the unit tests
+    # deterministic.  A tuple is marginally cheaper to pack into each
+    # StepRequest than a list.
+    self._requested_observation_uids = tuple(sorted(
         self._observation_specs.name_to_uid(name)
         for name in requested_observations
-    ]
-
-    # Not strictly necessary but it makes the unit tests deterministic.
-    self._requested_observation_uids.sort()
-
-    self._extension_names = extensions.keys()
+    ))
+
+    # The observation names are fixed, so split the nested ones into sub-keys
+    # once rather than on every step.  All names are included, as servers may
+    # return observations which weren't requested.
+    self._observation_key_paths = {}
+    if nested_tensors:
+      self._observation_key_paths = {
+          name: tuple(name.split(DEFAULT_KEY_SEPARATOR))
+          for name in observation_names
+          if DEFAULT_KEY_SEPARATOR in name
+      }
+
+    self._extension_names = tuple(extensions)
     for extension_name, extension in extensions.items():
       if hasattr(self, extension_name):
         raise ValueError(
@@ -170,51 +263,185 @@ class DmEnvAdaptor(dm_env.Environment):
     """Implements dm_env.Environment.reset."""
     if self._connection is None:
       raise ValueError('Cannot reset environment after connection is closed.')
+    self._process_async_steps()
+    send_many = (
+        getattr(self._connection, 'send_many', None)
+        if self._pipeline_reset else None)
+    if send_many is not None:
+      reset_response, step_response = send_many(
+          [dm_env_rpc_pb2.ResetRequest(), self._step_request({})])
+      self._check_reset_response(reset_response)
+      self._last_state = _INTERRUPTED
+      return self._timestep_from_response(step_response)
+
+    self._check_reset_response(
+        self._connection.send(dm_env_rpc_pb2.ResetRequest()))
+    self._last_state = _INTERRUPTED
+    return self.step({})
+
+  def _check_reset_response(self, reset_response):
+    """Raises RuntimeError if `reset_response` changed the environment specs."""
     reset_response = _check_response_type(
-        self._connection.send(dm_env_rpc_pb2.ResetRequest()),
-        dm_env_rpc_pb2.ResetResponse,
-    )
+        reset_response, dm_env_rpc_pb2.ResetResponse)
 
-    if self._dm_env_rpc_specs != reset_response.specs:
+    # Comparing serialized bytes is cheaper than message equality.  Only fall
+    # back to the latter if the encodings differ, e.g. due to unknown fields.
+    if (reset_response.specs.SerializeToString(deterministic=True) !=
+        self._serialized_specs and
+        self._dm_env_rpc_specs != reset_response.specs):
       raise RuntimeError(
           _RESET_ENVIRONMENT_ERROR.format(
               specs=self._dm_env_rpc_specs, new_specs=reset_response.specs
           )
       )
-    self._last_state = dm_env_rpc_pb2.EnvironmentStateType.INTERRUPTED
-    return self.step({})
 
   def step(self, actions):
     """Implements dm_env.Environment.step."""
+    if self._connection is None:
+      raise ValueError('Cannot step environment, connection is closed.')
+    self._process_async_steps()
+    return self._timestep_from_response(
+        self._connection.send(self._step_request(actions)))
+
+  def step_many(self, actions_sequence):
+    """Steps the environment once for each element of `actions_sequence`.
+
+    Equivalent to calling `step` with each element in turn, except that if the
+    connection is a dm_env_rpc Connection all the StepRequests are sent before
+    any response is read, so the steps cost a single round-trip.  This is only
+    useful when the actions don't depend on the preceding observations.  If a
+    subclass overrides `step`, it is called for each element instead.
+
+    Args:
+      actions_sequence: A sequence of actions, each as would be passed to
+        `step`.
+
+    Returns:
+      A list of `dm_env.TimeStep`s, one for each element of `actions_sequence`.
+
+    Raises:
+      DmEnvRpcError: The server responded to any of the steps with an error.
+        The steps before it still update the environment's state.  When sent as
+        a batch, the steps after it have also been sent to the server.
+    """
+    if self._connection is None:
+      raise ValueError('Cannot step environment, connection is closed.')
+    if (type(self).step is not DmEnvAdaptor.step or
+        not isinstance(self._connection, dm_env_rpc_connection.Connection)):
+      return [self.step(actions) for actions in actions_sequence]
+    self._process_async_steps()
+    requests = [self._step_request(actions) for actions in actions_sequence]
+    timesteps = []
+    for response in self._connection.send_many(
+        requests, return_exceptions=True):
+      if isinstance(response, Exception):
+        raise response
+      timesteps.append(self._timestep_from_response(response))
+    return timesteps
+
+  def step_async(self, actions) -> 'futures.Future[dm_env.TimeStep]':
+    """Sends a step to the environment without waiting for its TimeStep.
+
+    Lets the caller overlap work, such as computing the next action, with the
+    round-trip to the server:
+
+        timestep_future = env.step_async(actions)
+        ...  # Do other work.
+        timestep = timestep_future.result()
+
+    If the connection is a dm_env_rpc Connection the request is sent and this
+    returns immediately.  The TimeStep is built on the thread which calls the
+    future's `result`, `exception`, `done` or `cancelled`, or on the next call
+    to `reset`, `step` or `step_many`, in the order the steps were sent.
+    Otherwise, or if a subclass overrides `step`, `step` is called and an
+    already completed future is returned.
+
+    Args:
+      actions: The actions to step with, as would be passed to `step`.
+
+    Returns:
+      A future for the `dm_env.TimeStep`.  It raises any error `step` would,
+      and is cancelled if the connection is closed before the server responds.
+    """
+    if self._connection is None:
+      raise ValueError('Cannot step environment, connection is closed.')
+    if (type(self).step is not DmEnvAdaptor.step or
+        not isinstance(self._connection, dm_env_rpc_connection.Connection)):
+      timestep_future = futures.Future()
+      try:
+        timestep_future.set_result(self.step(actions))
+      except Exception as e:  # pylint: disable=broad-except
+        timestep_future.set_exception(e)
+      return timestep_future
+
+    response_future = self._connection.send_async(self._step_request(actions))
+    timestep_future = _AsyncTimeStep(self._process_async_steps)
+    self._async_steps.append((timestep_future, response_future))
+    return timestep_future
+
+  def _process_async_steps(self, until=None, block=True, timeout=None):
+    """Builds the TimeSteps for `step_async`, in the order they were sent.
+
+    Args:
+      until: The TimeStep future to stop after, or None to process every step.
+        Nothing is done if it has already been processed.
+      block: Whether to wait for responses which haven't been received yet.  If
+        False, processing stops at the first of them.
+      timeout: The maximum number of seconds to wait for each response.
+
+    Raises:
+      TimeoutError: A response wasn't received within `timeout` seconds.
+    """
+    if until is not None and not any(
+        timestep_future is until for timestep_future, _ in self._async_steps):
+      return
+    while self._async_steps:
+      timestep_future, response_future = self._async_steps[0]
+      if block:
+        futures.wait((response_future,), timeout)
+      if not response_future.done():
+        if block:
+          raise futures.TimeoutError()
+        return
+      self._async_steps.popleft()
+      if response_future.cancelled():
+        timestep_future.cancel()
+      else:
+        # The TimeStep is built even if `timestep_future` was cancelled, so the
+        # environment's state stays in step with the server's.
+        try:
+          timestep = self._timestep_from_response(response_future.result())
+        except Exception as e:  # pylint: disable=broad-except
+          if timestep_future.set_running_or_notify_cancel():
+            timestep_future.set_exception(e)
+        else:
+          if timestep_future.set_running_or_notify_cancel():
+            timestep_future.set_result(timestep)
+      if timestep_future is until:
+        return
+
+  def _step_request(self, actions):
+    """Returns the StepRequest to send for `actions`."""
     actions = (
         dm_env_flatten_utils.flatten_dict(actions, DEFAULT_KEY_SEPARATOR)
-        if self._nested_tensors
+        if self._nested_tensors and _needs_flattening(actions)
         else actions
     )
-    if self._connection is None:
-      raise ValueError('Cannot step environment, connection is closed.')
-    step_response = _check_response_type(
-        self._connection.send(
-            dm_env_rpc_pb2.StepRequest(
-                requested_observations=self._requested_observation_uids,
-                actions=self._action_specs.pack(actions),
-            )
-        ),
-        dm_env_rpc_pb2.StepResponse,
+    return dm_env_rpc_pb2.StepRequest(
+        requested_observations=self._requested_observation_uids,
+        actions=self._action_specs.pack(actions),
     )
 
+  def _timestep_from_response(self, step_response):
+    """Returns the TimeStep for `step_response` and updates the last state."""
+    step_response = _check_response_type(
+        step_response, dm_env_rpc_pb2.StepResponse)
+
     observations = self._observation_specs.unpack(step_response.observations)
 
-    if (
-        step_response.state == dm_env_rpc_pb2.EnvironmentStateType.RUNNING
-        and self._last_state == dm_env_rpc_pb2.EnvironmentStateType.RUNNING
-    ):
-      step_type = dm_env.StepType.MID
-    elif step_response.state == dm_env_rpc_pb2.EnvironmentStateType.RUNNING:
-      step_type = dm_env.StepType.FIRST
-    elif self._last_state == dm_env_rpc_pb2.EnvironmentStateType.RUNNING:
-      step_type = dm_env.StepType.LAST
-    else:
+    step_type = _STEP_TYPES.get(
+        (self._last_state == _RUNNING, step_response.state == _RUNNING))
+    if step_type is None:
       # Neither response.state nor _last_state is RUNNING.
       # See common causes for state transition errors:
       # https://github.com/deepmind/dm_env_rpc/blob/master/docs/v1/appendix.md#common-state-transition-errors
@@ -237,13 +464,16 @@ class DmEnvAdaptor(dm_env.Environment):
         step_type=step_type,
         observations=observations,
     )
-    if not self._is_reward_requested:
-      observations.pop(DEFAULT_REWARD_KEY, None)
-    if not self._is_discount_requested:
-      observations.pop(DEFAULT_DISCOUNT_KEY, None)
+    for name in self._stripped_observation_names:
+      observations.pop(name, None)
+    # If no name has sub-keys, unflattening would return the same structure.
     observations = (
-        dm_env_flatten_utils.unflatten_dict(observations, DEFAULT_KEY_SEPARATOR)
-        if self._nested_tensors
+        dm_env_flatten_utils.unflatten_dict(
+            observations,
+            DEFAULT_KEY_SEPARATOR,
+            key_paths=self._observation_key_paths,
+        )
+        if not self._observation_key_paths.keys().isdisjoint(observations)
         else observations
     )
     return dm_env.TimeStep(step_type, reward, discount, observations)
@@ -291,41 +521,39 @@ class DmEnvAdaptor(dm_env.Environment):
       return observations[DEFAULT_DISCOUNT_KEY]
     if step_type == dm_env.StepType.FIRST:
       return None
-    elif (
-        state == dm_env_rpc_pb2.EnvironmentStateType.RUNNING
-        or state == dm_env_rpc_pb2.EnvironmentStateType.INTERRUPTED
-    ):
+    elif state == _RUNNING or state == _INTERRUPTED:
       return 1.0
     else:
       return 0.0
 
   def observation_spec(self):
     """Implements dm_env.Environment.observation_spec."""
-    specs = {}
-    for uid in self._requested_observation_uids:
-      name = self._observation_specs.uid_to_name(uid)
-      specs[name] = dm_env_utils.tensor_spec_to_dm_env_spec(
-          self._observation_specs.uid_to_spec(uid)
-      )
-    if not self._is_reward_requested:
-      specs.pop(DEFAULT_REWARD_KEY, None)
-    if not self._is_discount_requested:
-      specs.pop(DEFAULT_DISCOUNT_KEY, None)
+    if self._observation_spec is None:
+      specs = {}
+      for uid in self._requested_observation_uids:
+        name = self._observation_specs.uid_to_name(uid)
+        specs[name] = dm_env_utils.tensor_spec_to_dm_env_spec(
+            self._observation_specs.uid_to_spec(uid)
+        )
+      for name in self._stripped_observation_names:
+        specs.pop(name, None)
 
-    if self._nested_tensors:
-      return dm_env_flatten_utils.unflatten_dict(specs, DEFAULT_KEY_SEPARATOR)
-    else:
-      return specs
+      if self._nested_tensors:
+        specs = dm_env_flatten_utils.unflatten_dict(
+            specs, DEFAULT_KEY_SEPARATOR)
+      self._observation_spec = specs
+    return _copy_nested_dict(self._observation_spec)
 
   def action_spec(self):
     """Implements dm_env.Environment.action_spec."""
-    action_spec = dm_env_utils.dm_env_spec(self._action_specs)
-    if self._nested_tensors:
-      return dm_env_flatten_utils.unflatten_dict(
-          action_spec, DEFAULT_KEY_SEPARATOR
-      )
-    else:
-      return action_spec
+    if self._action_spec is None:
+      action_spec = dm_env_utils.dm_env_spec(self._action_specs)
+      if self._nested_tensors:
+        action_spec = dm_env_flatten_utils.unflatten_dict(
+            action_spec, DEFAULT_KEY_SEPARATOR
+        )
+      self._action_spec = action_spec
+    return _copy_nested_dict(self._action_spec)
 
   def reward_spec(self):
     """Implements dm_env.Environment.reward_spec."""
@@ -346,6 +574,21 @@ class DmEnvAdaptor(dm_env.Environment):
       self._connection = None
 
 
+def _pack_settings(
+    settings: Mapping[str, Any]) -> Dict[str, dm_env_rpc_pb2.Tensor]:
+  """Flattens `settings` and packs any values which aren't already Tensors."""
+  return {
+      key: (
+          value
+          if isinstance(value, dm_env_rpc_pb2.Tensor)
+          else tensor_utils.pack_tensor(value)
+      )
+      for key, value in dm_env_flatten_utils.flatten_dict(
+          settings, DEFAULT_KEY_SEPARATOR, strict=False
+      ).items()
+  }
+
+
 def create_world(
     connection: dm_env_rpc_connection.ConnectionType,
     create_world_settings: Mapping[str, Any],
@@ -365,21 +608,11 @@ def create_world(
   Raises:
     RuntimeError: If something went wrong creating the world.
   """
-  create_world_settings = dm_env_flatten_utils.flatten_dict(
-      create_world_settings, DEFAULT_KEY_SEPARATOR, strict=False
-  )
-
-  create_world_settings = {
-      key: (
-          value
-          if isinstance(value, dm_env_rpc_pb2.Tensor)
-          else tensor_utils.pack_tensor(value)
-      )
-      for key, value in create_world_settings.items()
-  }
   response = _check_response_type(
       connection.send(
-          dm_env_rpc_pb2.CreateWorldRequest(settings=create_world_settings)
+          dm_env_rpc_pb2.CreateWorldRequest(
+              settings=_pack_settings(create_world_settings)
+          )
       ),
       dm_env_rpc_pb2.CreateWorldResponse,
   )
@@ -411,22 +644,11 @@ def join_world(
   Raises:
     RuntimeError: If connection doesn't return a JoinWorldResponse.
   """
-  join_world_settings = dm_env_flatten_utils.flatten_dict(
-      join_world_settings, DEFAULT_KEY_SEPARATOR, strict=False
-  )
-
-  join_world_settings = {
-      key: (
-          value
-          if isinstance(value, dm_env_rpc_pb2.Tensor)
-          else tensor_utils.pack_tensor(value)
-      )
-      for key, value in join_world_settings.items()
-  }
   response = _check_response_type(
       connection.send(
           dm_env_rpc_pb2.JoinWorldRequest(
-              world_name=world_name, settings=join_world_settings
+              world_name=world_name,
+              settings=_pack_settings(join_world_settings),
           )
       ),
       dm_env_rpc_pb2.JoinWorldResponse,
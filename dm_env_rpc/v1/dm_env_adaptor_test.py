@@ -14,6 +14,8 @@
 # ============================================================================
 """Tests for dm_env_rpc/dm_env adaptor."""
 
+from concurrent import futures
+import threading
 from unittest import mock
 
 from absl.testing import absltest
@@ -24,6 +26,7 @@ import numpy as np
 
 from google.rpc import status_pb2
 from google.protobuf import text_format
+from dm_env_rpc.v1 import connection as dm_env_rpc_connection
 from dm_env_rpc.v1 import dm_env_adaptor
 from dm_env_rpc.v1 import dm_env_rpc_pb2
 from dm_env_rpc.v1 import error
@@ -217,6 +220,221 @@ class DmEnvAdaptorTests(absltest.TestCase):
     self.assertEqual(0.0, timestep.discount)
     self.assertEqual({'foo': 5, 'bar': 'goodbye'}, timestep.observation)
 
+  def test_step_many(self):
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    connection.send_many.return_value = [
+        _SAMPLE_STEP_RESPONSE, _SAMPLE_STEP_RESPONSE, _TERMINATED_STEP_RESPONSE
+    ]
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    timesteps = env.step_many([{'foo': 4, 'bar': 'hello'}] * 3)
+
+    connection.send_many.assert_called_once_with(
+        [_SAMPLE_STEP_REQUEST] * 3, return_exceptions=True)
+    connection.send.assert_not_called()
+    self.assertEqual(
+        [dm_env.StepType.FIRST, dm_env.StepType.MID, dm_env.StepType.LAST],
+        [timestep.step_type for timestep in timesteps])
+    self.assertEqual({'foo': 5, 'bar': 'goodbye'}, timesteps[-1].observation)
+
+  def test_step_many_error_keeps_earlier_steps(self):
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    connection.send_many.return_value = [
+        _SAMPLE_STEP_RESPONSE, error.DmEnvRpcError(status_pb2.Status()),
+        _SAMPLE_STEP_RESPONSE
+    ]
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    with self.assertRaises(error.DmEnvRpcError):
+      env.step_many([{'foo': 4, 'bar': 'hello'}] * 3)
+
+    connection.send.return_value = _SAMPLE_STEP_RESPONSE
+    timestep = env.step({'foo': 4, 'bar': 'hello'})
+    self.assertEqual(dm_env.StepType.MID, timestep.step_type)
+
+  def test_step_many_other_connection_types_send_each_step(self):
+    self._connection.send = mock.MagicMock(return_value=_SAMPLE_STEP_RESPONSE)
+    self._env.step_many([{'foo': 4, 'bar': 'hello'}] * 2)
+
+    self._connection.send.assert_has_calls(
+        [mock.call(_SAMPLE_STEP_REQUEST)] * 2)
+    self._connection.send_many.assert_not_called()
+
+  def test_step_many_calls_overridden_step(self):
+
+    class StepCountingAdaptor(dm_env_adaptor.DmEnvAdaptor):
+
+      def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.step_count = 0
+
+      def step(self, actions):
+        self.step_count += 1
+        return super().step(actions)
+
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    connection.send.return_value = _SAMPLE_STEP_RESPONSE
+    env = StepCountingAdaptor(connection, _SAMPLE_SPEC)
+    env.step_many([{'foo': 4, 'bar': 'hello'}] * 2)
+
+    self.assertEqual(2, env.step_count)
+    connection.send_many.assert_not_called()
+
+  def test_step_many_without_send_many_error_keeps_earlier_steps(self):
+    connection = mock.MagicMock(spec=['send'])
+    connection.send.side_effect = [
+        _SAMPLE_STEP_RESPONSE, error.DmEnvRpcError(status_pb2.Status()),
+        _SAMPLE_STEP_RESPONSE
+    ]
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    with self.assertRaises(error.DmEnvRpcError):
+      env.step_many([{'foo': 4, 'bar': 'hello'}] * 2)
+
+    timestep = env.step({'foo': 4, 'bar': 'hello'})
+    self.assertEqual(dm_env.StepType.MID, timestep.step_type)
+
+  def test_step_many_without_send_many(self):
+    connection = mock.MagicMock(spec=['send'])
+    connection.send.side_effect = [
+        _SAMPLE_STEP_RESPONSE, _SAMPLE_STEP_RESPONSE
+    ]
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    timesteps = env.step_many([{'foo': 4, 'bar': 'hello'}] * 2)
+
+    connection.send.assert_has_calls([mock.call(_SAMPLE_STEP_REQUEST)] * 2)
+    self.assertEqual([dm_env.StepType.FIRST, dm_env.StepType.MID],
+                     [timestep.step_type for timestep in timesteps])
+
+  def test_step_async(self):
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    response_futures = [futures.Future(), futures.Future()]
+    connection.send_async.side_effect = response_futures
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    timestep_futures = [
+        env.step_async({'foo': 4, 'bar': 'hello'}) for _ in range(2)
+    ]
+
+    connection.send_async.assert_has_calls(
+        [mock.call(_SAMPLE_STEP_REQUEST)] * 2)
+    self.assertFalse(timestep_futures[0].done())
+    for response_future in response_futures:
+      response_future.set_result(_SAMPLE_STEP_RESPONSE)
+    self.assertEqual(
+        [dm_env.StepType.FIRST, dm_env.StepType.MID],
+        [future.result().step_type for future in timestep_futures])
+    self.assertEqual({'foo': 5, 'bar': 'goodbye'},
+                     timestep_futures[-1].result().observation)
+
+  def test_step_async_processes_steps_in_order_sent(self):
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    response_futures = [futures.Future(), futures.Future()]
+    connection.send_async.side_effect = response_futures
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    timestep_futures = [env.step_async({}) for _ in range(2)]
+    for response_future in response_futures:
+      response_future.set_result(_SAMPLE_STEP_RESPONSE)
+
+    self.assertEqual(dm_env.StepType.MID,
+                     timestep_futures[1].result().step_type)
+    self.assertEqual(dm_env.StepType.FIRST,
+                     timestep_futures[0].result().step_type)
+
+  def test_step_after_step_async_processes_it_first(self):
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    response_future = futures.Future()
+    connection.send_async.return_value = response_future
+    connection.send.return_value = _SAMPLE_STEP_RESPONSE
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    timestep_future = env.step_async({})
+    response_future.set_result(_SAMPLE_STEP_RESPONSE)
+
+    self.assertEqual(dm_env.StepType.MID, env.step({}).step_type)
+    self.assertEqual(dm_env.StepType.FIRST,
+                     timestep_future.result().step_type)
+
+  def test_step_async_builds_timestep_on_calling_thread(self):
+
+    class ThreadRecordingAdaptor(dm_env_adaptor.DmEnvAdaptor):
+
+      def _timestep_from_response(self, step_response):
+        self.timestep_thread = threading.current_thread()
+        return super()._timestep_from_response(step_response)
+
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    response_future = futures.Future()
+    connection.send_async.return_value = response_future
+    env = ThreadRecordingAdaptor(connection, _SAMPLE_SPEC)
+    timestep_future = env.step_async({})
+    responder = threading.Thread(
+        target=response_future.set_result, args=(_SAMPLE_STEP_RESPONSE,))
+    responder.start()
+    responder.join()
+    timestep_future.result()
+
+    self.assertIs(threading.current_thread(), env.timestep_thread)
+
+  def test_step_async_error(self):
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    response_future = futures.Future()
+    response_future.set_exception(
+        error.DmEnvRpcError(status_pb2.Status(message='A test error.')))
+    connection.send_async.return_value = response_future
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    timestep_future = env.step_async({})
+
+    with self.assertRaisesRegex(error.DmEnvRpcError, 'A test error.'):
+      timestep_future.result()
+
+  def test_step_async_timeout(self):
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    connection.send_async.return_value = futures.Future()
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    timestep_future = env.step_async({})
+
+    with self.assertRaises(futures.TimeoutError):
+      timestep_future.result(timeout=0)
+
+  def test_step_async_cancelled(self):
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    response_future = futures.Future()
+    connection.send_async.return_value = response_future
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    timestep_future = env.step_async({})
+    response_future.cancel()
+
+    self.assertTrue(timestep_future.cancelled())
+
+  def test_step_async_other_connection_types_step_synchronously(self):
+    connection = mock.MagicMock(spec=['send'])
+    connection.send.return_value = _SAMPLE_STEP_RESPONSE
+    env = dm_env_adaptor.DmEnvAdaptor(connection, _SAMPLE_SPEC)
+    timestep_future = env.step_async({'foo': 4, 'bar': 'hello'})
+
+    connection.send.assert_called_once_with(_SAMPLE_STEP_REQUEST)
+    self.assertTrue(timestep_future.done())
+    self.assertEqual(dm_env.StepType.FIRST,
+                     timestep_future.result().step_type)
+
+  def test_step_async_calls_overridden_step(self):
+
+    class StepCountingAdaptor(dm_env_adaptor.DmEnvAdaptor):
+
+      def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.step_count = 0
+
+      def step(self, actions):
+        self.step_count += 1
+        return super().step(actions)
+
+    connection = mock.MagicMock(spec=dm_env_rpc_connection.Connection)
+    connection.send.return_value = _SAMPLE_STEP_RESPONSE
+    env = StepCountingAdaptor(connection, _SAMPLE_SPEC)
+    timestep_future = env.step_async({'foo': 4, 'bar': 'hello'})
+
+    self.assertEqual(1, env.step_count)
+    self.assertEqual(dm_env.StepType.FIRST,
+                     timestep_future.result().step_type)
+    connection.send_async.assert_not_called()
+
   def test_illegal_state_transition(self):
     self._connection.send = mock.MagicMock(
         return_value=_TERMINATED_STEP_RESPONSE)
@@ -237,6 +455,35 @@ class DmEnvAdaptorTests(absltest.TestCase):
     self.assertIsNone(timestep.discount)
     self.assertEqual({'foo': 5, 'bar': 'goodbye'}, timestep.observation)
 
+  def test_pipelined_reset(self):
+    env = dm_env_adaptor.DmEnvAdaptor(
+        self._connection, _SAMPLE_SPEC, pipeline_reset=True)
+    self._connection.send_many = mock.MagicMock(
+        return_value=[_SAMPLE_RESET_RESPONSE, _SAMPLE_STEP_RESPONSE])
+    timestep = env.reset()
+
+    self._connection.send_many.assert_called_once_with([
+        dm_env_rpc_pb2.ResetRequest(),
+        dm_env_rpc_pb2.StepRequest(requested_observations=[1, 2]),
+    ])
+    self.assertEqual(dm_env.StepType.FIRST, timestep.step_type)
+    self.assertEqual({'foo': 5, 'bar': 'goodbye'}, timestep.observation)
+
+  def test_pipelined_reset_without_send_many(self):
+    connection = mock.MagicMock(spec=['send'])
+    connection.send.side_effect = [
+        _SAMPLE_RESET_RESPONSE, _SAMPLE_STEP_RESPONSE
+    ]
+    env = dm_env_adaptor.DmEnvAdaptor(
+        connection, _SAMPLE_SPEC, pipeline_reset=True)
+    timestep = env.reset()
+
+    connection.send.assert_has_calls([
+        mock.call(dm_env_rpc_pb2.ResetRequest()),
+        mock.call(dm_env_rpc_pb2.StepRequest(requested_observations=[1, 2])),
+    ])
+    self.assertEqual(dm_env.StepType.FIRST, timestep.step_type)
+
   def test_spec_generate_value_step(self):
     self._connection.send = mock.MagicMock(return_value=_SAMPLE_STEP_RESPONSE)
     action_spec = self._env.action_spec()
@@ -276,6 +523,21 @@ class DmEnvAdaptorTests(absltest.TestCase):
     }
     self.assertEqual(expected_spec, self._env.action_spec())
 
+  def test_specs_are_reused(self):
+    self.assertEqual(self._env.observation_spec(),
+                     self._env.observation_spec())
+    self.assertEqual(self._env.action_spec(), self._env.action_spec())
+
+  def test_modifying_specs_does_not_change_env(self):
+    expected_spec = {
+        'foo': specs.Array(shape=(), dtype=np.uint8, name='foo'),
+        'bar': specs.StringArray(shape=(), name='bar')
+    }
+    del self._env.observation_spec()['foo']
+    self._env.action_spec()['baz'] = specs.Array(shape=(), dtype=np.uint8)
+    self.assertEqual(expected_spec, self._env.observation_spec())
+    self.assertEqual(expected_spec, self._env.action_spec())
+
   def test_cant_step_after_close(self):
     self._connection.send = mock.MagicMock(
         return_value=dm_env_rpc_pb2.LeaveWorldResponse())
@@ -283,6 +545,20 @@ class DmEnvAdaptorTests(absltest.TestCase):
     with self.assertRaisesRegex(ValueError, 'connection'):
       self._env.step({})
 
+  def test_cant_step_many_after_close(self):
+    self._connection.send = mock.MagicMock(
+        return_value=dm_env_rpc_pb2.LeaveWorldResponse())
+    self._env.close()
+    with self.assertRaisesRegex(ValueError, 'connection'):
+      self._env.step_many([{}])
+
+  def test_cant_step_async_after_close(self):
+    self._connection.send = mock.MagicMock(
+        return_value=dm_env_rpc_pb2.LeaveWorldResponse())
+    self._env.close()
+    with self.assertRaisesRegex(ValueError, 'connection'):
+      self._env.step_async({})
+
   def test_cant_reset_after_close(self):
     self._connection.send = mock.MagicMock(
         return_value=dm_env_rpc_pb2.LeaveWorldResponse())
@@ -537,6 +813,14 @@ class EnvironmentNestedActionsObservations(absltest.TestCase):
     self.assertSameElements(expected_actions, env.action_spec())
     self.assertSameElements(expected_observations, env.observation_spec())
 
+  def test_modifying_nested_specs_does_not_change_env(self):
+    env = dm_env_adaptor.DmEnvAdaptor(
+        connection=mock.MagicMock(), specs=_SAMPLE_NESTED_SPECS)
+    del env.action_spec()['foo']['bar']
+    del env.observation_spec()['foo']['bar']
+    self.assertIn('bar', env.action_spec()['foo'])
+    self.assertIn('bar', env.observation_spec()['foo'])
+
   def test_no_nested_specs(self):
     env = dm_env_adaptor.DmEnvAdaptor(
         connection=mock.MagicMock(),
@@ -571,6 +855,13 @@ class EnvironmentNestedActionsObservations(absltest.TestCase):
             """actions: { key: 1, value: { int32s: { array: 123 } } }""",
             dm_env_rpc_pb2.StepRequest()))
 
+  def test_nested_actions_step_rejects_flattened_keys(self):
+    env = dm_env_adaptor.DmEnvAdaptor(
+        mock.MagicMock(), specs=_SAMPLE_NESTED_SPECS, requested_observations=[])
+
+    with self.assertRaisesRegex(ValueError, 'already contains the separator'):
+      env.step({'foo.bar': 123})
+
   def test_no_nested_actions_step(self):
     connection = mock.MagicMock()
     connection.send = mock.MagicMock(
@@ -611,6 +902,72 @@ class EnvironmentNestedActionsObservations(absltest.TestCase):
     connection.send.assert_called_once_with(
         dm_env_rpc_pb2.StepRequest(requested_observations=[1]))
 
+  def test_nested_observations_step_multiple_levels(self):
+    connection = mock.MagicMock()
+    connection.send = mock.MagicMock(
+        return_value=text_format.Parse(
+            """state: RUNNING
+        observations: { key: 1, value: { int32s: { array: 42 } } }
+        observations: { key: 2, value: { int32s: { array: 7 } } }
+        observations: { key: 3, value: { strings: { array: 'qux' } } }""",
+            dm_env_rpc_pb2.StepResponse()))
+    specs = dm_env_rpc_pb2.ActionObservationSpecs(
+        observations={
+            1: dm_env_rpc_pb2.TensorSpec(
+                dtype=dm_env_rpc_pb2.INT32, name='foo.bar.baz'),
+            2: dm_env_rpc_pb2.TensorSpec(
+                dtype=dm_env_rpc_pb2.INT32, name='foo.qux'),
+            3: dm_env_rpc_pb2.TensorSpec(
+                dtype=dm_env_rpc_pb2.STRING, name='quux'),
+        })
+
+    env = dm_env_adaptor.DmEnvAdaptor(connection, specs=specs)
+    timestep = env.step({})
+    self.assertEqual(
+        {'foo': {'bar': {'baz': 42}, 'qux': 7}, 'quux': 'qux'},
+        timestep.observation)
+
+  def test_unrequested_nested_observations_are_unflattened(self):
+    connection = mock.MagicMock()
+    connection.send = mock.MagicMock(
+        return_value=text_format.Parse(
+            """state: RUNNING
+        observations: { key: 1, value: { int32s: { array: 42 } } }
+        observations: { key: 2, value: { strings: { array: 'qux' } } }""",
+            dm_env_rpc_pb2.StepResponse()))
+    specs = dm_env_rpc_pb2.ActionObservationSpecs(
+        observations={
+            1: dm_env_rpc_pb2.TensorSpec(
+                dtype=dm_env_rpc_pb2.INT32, name='foo.bar'),
+            2: dm_env_rpc_pb2.TensorSpec(
+                dtype=dm_env_rpc_pb2.STRING, name='quux'),
+        })
+
+    env = dm_env_adaptor.DmEnvAdaptor(
+        connection, specs=specs, requested_observations=['quux'])
+    timestep = env.step({})
+    self.assertEqual({'foo': {'bar': 42}, 'quux': 'qux'}, timestep.observation)
+
+  def test_nested_observations_step_conflicting_names(self):
+    connection = mock.MagicMock()
+    connection.send = mock.MagicMock(
+        return_value=text_format.Parse(
+            """state: RUNNING
+        observations: { key: 1, value: { int32s: { array: 42 } } }
+        observations: { key: 2, value: { int32s: { array: 7 } } }""",
+            dm_env_rpc_pb2.StepResponse()))
+    specs = dm_env_rpc_pb2.ActionObservationSpecs(
+        observations={
+            1: dm_env_rpc_pb2.TensorSpec(
+                dtype=dm_env_rpc_pb2.INT32, name='foo'),
+            2: dm_env_rpc_pb2.TensorSpec(
+                dtype=dm_env_rpc_pb2.INT32, name='foo.bar'),
+        })
+
+    env = dm_env_adaptor.DmEnvAdaptor(connection, specs=specs)
+    with self.assertRaisesRegex(ValueError, 'already been assigned'):
+      env.step({})
+
   def test_extensions(self):
     class _ExampleExtension:
 
@@ -624,6 +981,18 @@ class EnvironmentNestedActionsObservations(absltest.TestCase):
 
     self.assertEqual('bar', env.extension.foo())
 
+  def test_close_only_releases_extensions_given_at_init(self):
+    extensions = {'extension': object()}
+    env = dm_env_adaptor.DmEnvAdaptor(
+        connection=mock.MagicMock(),
+        specs=_SAMPLE_SPEC,
+        extensions=extensions)
+    extensions['other_extension'] = object()
+
+    env.close()
+    self.assertIsNone(env.extension)
+    self.assertFalse(hasattr(env, 'other_extension'))
+
   def test_invalid_extension_attr(self):
     with self.assertRaisesRegex(ValueError,
                                 'DmEnvAdaptor already has attribute'):
@@ -14,7 +14,8 @@
 # ============================================================================
 """Python utilities for flattening and unflattening key-value mappings."""
 
-from typing import Any, Dict, Mapping
+import collections.abc
+from typing import Any, Dict, Mapping, Optional, Sequence
 
 
 def flatten_dict(
@@ -42,25 +43,36 @@ def flatten_dict(
       string, and strict is set to False.
   """
   result: Dict[str, Any] = {}
-  for key, value in input_dict.items():
-    if strict and separator in key:
-      raise ValueError(
-          f"Can not safely flatten dictionary: key '{key}' already contains "
-          f"the separator '{separator}'!"
-      )
-    if isinstance(value, Mapping) and len(value):
-      result.update({
-          f'{key}{separator}{sub_key}': sub_value
-          for sub_key, sub_value in flatten_dict(
-              value, separator, strict=strict).items()
-      })
-    else:
+  # Walks the mappings depth-first without recursion, so each leaf is inserted
+  # into `result` once rather than once per level of nesting.  Each frame holds
+  # an iterator over a mapping's items and that mapping's flattened key followed
+  # by the separator, which is None at the top level.
+  stack = [(iter(input_dict.items()), None)]
+  while stack:
+    items, prefix = stack[-1]
+    for key, value in items:
+      if strict and separator in key:
+        raise ValueError(
+            f"Can not safely flatten dictionary: key '{key}' already contains "
+            f"the separator '{separator}'!"
+        )
+      if prefix is not None:
+        key = f'{prefix}{key}'
+      if isinstance(value, collections.abc.Mapping) and len(value):
+        stack.append((iter(value.items()), f'{key}{separator}'))
+        break
       result[key] = value
+    else:
+      stack.pop()
   return result
 
 
-def unflatten_dict(input_dict: Mapping[str, Any],
-                   separator: str) -> Dict[str, Any]:
+def unflatten_dict(
+    input_dict: Mapping[str, Any],
+    separator: str,
+    *,
+    key_paths: Optional[Mapping[str, Sequence[str]]] = None,
+) -> Dict[str, Any]:
   """Unflatten dictionary using split keys to determine the structure.
 
   For each key, split based on the provided separator and create nested
@@ -69,6 +81,10 @@ def unflatten_dict(input_dict: Mapping[str, Any],
   Args:
     input_dict: Mapping of key-value pairs to un-flatten.
     separator: Delimiter used to split keys.
+    key_paths: Optional mapping of keys to their already split sub-keys, to
+      avoid splitting the same keys each time a dictionary with a fixed set of
+      keys is unflattened.  Keys not in `key_paths` are split using
+      `separator`.
 
   Returns:
     Unflattened dictionary.
@@ -78,17 +94,31 @@ def unflatten_dict(input_dict: Mapping[str, Any],
       instance, unflattening `{"foo": True, "foo.bar": "baz"}` will result in
       "foo" being set to both a dict and a Bool.
   """
+  if key_paths is None:
+    key_paths = {}
   result: Dict[str, Any] = {}
   for key, value in input_dict.items():
-    sub_keys = key.split(separator)
+    sub_keys = key_paths.get(key)
+    if sub_keys is None:
+      if separator not in key:
+        # Most keys aren't nested, so skip splitting them.
+        if key in result:
+          raise ValueError(f'Duplicate key {key}')
+        result[key] = value
+        continue
+      sub_keys = key.split(separator)
+    *parent_keys, leaf_key = sub_keys
     sub_tree = result
-    for sub_key in sub_keys[:-1]:
+    for sub_key in parent_keys:
       sub_tree = sub_tree.setdefault(sub_key, {})
-      if not isinstance(sub_tree, Mapping):
+      # Sub-trees are almost always the dicts created above, and checking for
+      # a dict first avoids the slower Mapping ABC instance check.
+      if not isinstance(sub_tree, dict) and not isinstance(
+          sub_tree, collections.abc.Mapping):
         raise ValueError(f"Sub-tree '{sub_key}' has already been assigned a "
                          f"leaf value {sub_tree}")
 
-    if sub_keys[-1] in sub_tree:
+    if leaf_key in sub_tree:
       raise ValueError(f'Duplicate key {key}')
-    sub_tree[sub_keys[-1]] = value
+    sub_tree[leaf_key] = value
   return result
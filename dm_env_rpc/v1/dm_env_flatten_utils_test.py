@@ -36,6 +36,29 @@ class FlattenUtilsTest(absltest.TestCase):
     self.assertSameElements(expected,
                             dm_env_flatten_utils.flatten_dict(input_dict, '.'))
 
+  def test_flatten_deeply_nested(self):
+    input_dict = {
+        'foo': {
+            'bar': {
+                'baz': 1,
+                'qux': {
+                    'quux': 2
+                },
+            },
+            'fiz': 3,
+        },
+        'buz': 4,
+    }
+    expected = [
+        ('foo.bar.baz', 1),
+        ('foo.bar.qux.quux', 2),
+        ('foo.fiz', 3),
+        ('buz', 4),
+    ]
+    self.assertEqual(
+        expected,
+        list(dm_env_flatten_utils.flatten_dict(input_dict, '.').items()))
+
   def test_unflatten(self):
     input_dict = {
         'foo.bar.baz': True,
@@ -58,6 +81,21 @@ class FlattenUtilsTest(absltest.TestCase):
     self.assertSameElements(
         expected, dm_env_flatten_utils.unflatten_dict(input_dict, '.'))
 
+  def test_unflatten_flat_and_nested_keys(self):
+    input_dict = {'foo': 1, 'bar.baz': 2, 'bar.qux': 3, 'fiz': {}}
+    expected = {'foo': 1, 'bar': {'baz': 2, 'qux': 3}, 'fiz': {}}
+    self.assertEqual(expected,
+                     dm_env_flatten_utils.unflatten_dict(input_dict, '.'))
+
+  def test_unflatten_with_key_paths(self):
+    input_dict = {'foo.bar': 1, 'fiz.buz': 2, 'qux': 3}
+    key_paths = {'foo.bar': ('foo', 'bar'), 'qux': ('baz', 'qux')}
+    expected = {'foo': {'bar': 1}, 'fiz': {'buz': 2}, 'baz': {'qux': 3}}
+    self.assertEqual(
+        expected,
+        dm_env_flatten_utils.unflatten_dict(
+            input_dict, '.', key_paths=key_paths))
+
   def test_unflatten_different_separator(self):
     input_dict = {'foo::bar.baz': True, 'foo.bar::baz': 1}
     expected = {'foo': {'bar.baz': True}, 'foo.bar': {'baz': 1}}
@@ -16,7 +16,7 @@
 """
 
 import typing
-from typing import Iterable, NamedTuple, Type, Union
+from typing import Dict, Iterable, NamedTuple, Type, Union
 
 import immutabledict
 
@@ -31,6 +31,11 @@ _MESSAGE_TYPE_TO_FIELD = immutabledict.immutabledict({
     for field in dm_env_rpc_pb2.EnvironmentRequest.DESCRIPTOR.fields
 })
 
+# Request message class to EnvironmentRequest field name.  Populated on first
+# use of each class, so repeated requests of the same type are a single dict
+# lookup keyed by type rather than a lookup by type name.
+_REQUEST_TYPE_TO_FIELD: Dict[Type[message.Message], str] = {}
+
 # An unpacked extension request (anything).
 # As any proto message that is not a native request is accepted, this definition
 # is overly broad - use with care.
@@ -187,7 +192,11 @@ def pack_environment_request(
       field_name: Name of the environment request field holding the input
         request message.
   """
-  field_name = _MESSAGE_TYPE_TO_FIELD[type(request).__name__]
+  request_type = type(request)
+  field_name = _REQUEST_TYPE_TO_FIELD.get(request_type)
+  if field_name is None:
+    field_name = _MESSAGE_TYPE_TO_FIELD[request_type.__name__]
+    _REQUEST_TYPE_TO_FIELD[request_type] = field_name
   environment_request = dm_env_rpc_pb2.EnvironmentRequest()
   getattr(environment_request, field_name).CopyFrom(request)
   return EnvironmentRequestAndFieldName(environment_request, field_name)
@@ -50,6 +50,14 @@ class MessageUtilsTests(parameterized.TestCase):
     self.assertEqual(environment_request.create_world,
                      _CREATE_WORLD_REQUEST)
 
+  def test_pack_extension_request_repeatedly(self):
+    for _ in range(2):
+      environment_request, field_name = (
+          message_utils.pack_environment_request(_PACKED_EXTENSION_MESSAGE))
+      self.assertEqual(field_name, 'extension')
+      self.assertEqual(environment_request.extension,
+                       _PACKED_EXTENSION_MESSAGE)
+
   def test_unpack_create_world_response(self):
     response = message_utils.unpack_environment_response(
         _CREATE_WORLD_ENVIRONMENT_RESPONSE, 'create_world')
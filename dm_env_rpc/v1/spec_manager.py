@@ -24,15 +24,19 @@ from dm_env_rpc.v1 import tensor_utils
 def _assert_shapes_match(tensor: dm_env_rpc_pb2.Tensor,
                          dm_env_rpc_spec: dm_env_rpc_pb2.TensorSpec):
   """Raises ValueError if shape of tensor and spec don't match."""
-  tensor_shape = np.asarray(tensor.shape)
-  spec_shape = np.asarray(dm_env_rpc_spec.shape)
+  tensor_shape = tensor.shape
+  spec_shape = dm_env_rpc_spec.shape
 
   # Check all elements are equal, or the spec element is -1 (variable length).
-  if tensor_shape.size != spec_shape.size or not np.all(
-      (tensor_shape == spec_shape) | (spec_shape < 0)):
+  # Shapes are short, so comparing them in Python is much cheaper than
+  # converting both to NumPy arrays on every pack and unpack.
+  if len(tensor_shape) != len(spec_shape) or any(
+      tensor_dim != spec_dim and spec_dim >= 0
+      for tensor_dim, spec_dim in zip(tensor_shape, spec_shape)):
     raise ValueError(
         'Received dm_env_rpc tensor {} with shape {} but spec has shape {}.'
-        .format(dm_env_rpc_spec.name, tensor_shape, spec_shape))
+        .format(dm_env_rpc_spec.name, np.asarray(tensor_shape),
+                np.asarray(spec_shape)))
 
 
 class SpecManager(object):
@@ -61,7 +65,9 @@ class SpecManager(object):
     if len(self._name_to_uid) != len(self._uid_to_name):
       raise ValueError('There are duplicate names in the tensor specs.')
 
-    self._specs_by_uid = specs
+    # Copy, as indexing a protobuf map with a missing key inserts a default
+    # value rather than raising KeyError.
+    self._specs_by_uid = dict(specs)
     self._specs_by_name = {spec.name: spec for spec in specs.values()}
 
   @property
@@ -109,8 +115,8 @@ class SpecManager(object):
     """
     unpacked = {}
     for uid, tensor in dm_env_rpc_tensors.items():
-      name = self._uid_to_name[uid]
-      dm_env_rpc_spec = self.name_to_spec(name)
+      dm_env_rpc_spec = self._specs_by_uid[uid]
+      name = dm_env_rpc_spec.name
       _assert_shapes_match(tensor, dm_env_rpc_spec)
       tensor_dtype = tensor_utils.get_tensor_type(tensor)
       spec_dtype = tensor_utils.data_type_to_np_type(dm_env_rpc_spec.dtype)
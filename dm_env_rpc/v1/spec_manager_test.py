@@ -129,6 +129,13 @@ class SpecManagerTests(absltest.TestCase):
     with self.assertRaisesRegex(KeyError, '53'):
       self._spec_manager.unpack({53: tensor_utils.pack_tensor('foo')})
 
+  def test_unpack_unknown_uid_with_proto_specs_raises_error(self):
+    specs = dm_env_rpc_pb2.ActionObservationSpecs(observations=_EXAMPLE_SPECS)
+    manager = spec_manager.SpecManager(specs.observations)
+    with self.assertRaisesRegex(KeyError, '53'):
+      manager.unpack({53: tensor_utils.pack_tensor('foo')})
+    self.assertNotIn(53, specs.observations)
+
   def test_unpack_wrong_shape_raises_error(self):
     with self.assertRaisesRegex(ValueError, 'shape'):
       self._spec_manager.unpack({55: tensor_utils.pack_tensor([1, 2])})
@@ -157,6 +164,12 @@ class SpecManagerVariableSpecShapeTests(absltest.TestCase):
     }
     self.assertDictEqual(expected, packed)
 
+  def test_unpack_variable_spec_shape(self):
+    unpacked = self._spec_manager.unpack({
+        101: tensor_utils.pack_tensor([[1, 2, 3]], dtype=np.int32),
+    })
+    np.testing.assert_array_equal([[1, 2, 3]], unpacked['foo'])
+
   def test_invalid_variable_shape(self):
     with self.assertRaisesRegex(ValueError, 'shape'):
       self._spec_manager.pack({'foo': np.ones((1, 2, 3), dtype=np.int32)})
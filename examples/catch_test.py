@@ -94,6 +94,27 @@ class CatchDmEnvRpcStepTest(compliance.Step):
     super().tearDown()
 
 
+class _SendOnlyConnection:
+  """Exposes only the `ConnectionType` methods of a connection."""
+
+  def __init__(self, connection):
+    self._connection = connection
+
+  def send(self, request):
+    return self._connection.send(request)
+
+  def close(self):
+    self._connection.close()
+
+
+class CatchDmEnvRpcStepSendOnlyConnectionTest(CatchDmEnvRpcStepTest):
+  """Runs the Step tests one request at a time, without `send_many`."""
+
+  @property
+  def connection(self):
+    return _SendOnlyConnection(self._server_connection.connection)
+
+
 class CatchDmEnvRpcCreateAndDestoryWorldTest(compliance.CreateDestroyWorld):
 
   @property